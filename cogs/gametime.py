@@ -1,12 +1,21 @@
 import asyncio
 
 import discord
-import json
 import logging
+import re
+import sqlite3
 import time
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from cogs.utils.analytics import GameAnalytics
 from cogs.utils.constants import *
-from cogs.utils.utils import create_json
+from cogs.utils.export import EXPORT_FORMATS, connect_read_only, export, get_filename
+from cogs.utils.gamehistory import GameHistory, get_day
+from cogs.utils.gamestore import GameStore
+from cogs.utils.leaderboard import Leaderboards
+from cogs.utils.timeslice import ShardTimings, TimeSlicer
+from cogs.utils.utils import load_json
 from discord.ext import commands, tasks
 from discord.ext.commands import Cog
 from pprint import pprint
@@ -14,50 +23,217 @@ from pprint import pprint
 
 log = logging.getLogger(__name__)
 
-# Frequencies in seconds
-UPDATE_FREQUENCY = 60
-SAVE_FREQUENCY = 2000
+# Frequencies in seconds, saves only write what changed so they can be frequent
+SAVE_FREQUENCY = 60
+# Number of saves kept for the save time stats
+SAVE_HISTORY = 50
+# Seconds the shards' reconciles are spread over after connecting
+RECONCILE_SPREAD = 10
+# Bytes Discord lets bots upload outside of guilds
+DEFAULT_UPLOAD_LIMIT = 25 * 1024 * 1024
+
+# Days in each unit of a !played window
+WINDOW_UNITS = {'d': 1, 'w': 7, 'm': 30, 'y': 365}
+NAMED_WINDOWS = {'today': 1, 'week': 7, 'month': 30, 'year': 365}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS gametime (
+    member_id INTEGER NOT NULL,
+    game_id INTEGER NOT NULL REFERENCES games (game_id),
+    seconds INTEGER NOT NULL,
+    PRIMARY KEY (member_id, game_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS gametime_member_seconds ON gametime (member_id, seconds DESC);
+"""
+UPSERT = """
+INSERT INTO gametime (member_id, game_id, seconds) VALUES (?, ?, ?)
+ON CONFLICT (member_id, game_id) DO UPDATE SET seconds = excluded.seconds
+"""
+MEMBER_GAMES_QUERY = """
+SELECT games.name, gametime.seconds FROM gametime JOIN games USING (game_id)
+WHERE gametime.member_id = ? ORDER BY gametime.seconds DESC
+"""
+
+
+def parse_window(window):
+    """Returns the number of days in a window like 7d, 2w, 3m or 1y, or None if it isn't one. """
+    window = window.lower()
+    if window in NAMED_WINDOWS:
+        return NAMED_WINDOWS[window]
+    match = re.fullmatch(r'(\d+)([dwmy])', window)
+    if match is None or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
 
 
 class GameData:
-    """A class containing the data of the players currently playing. """
+    """A class containing the gametime of every member, kept in a compact GameStore and saved to SQLite.
+
+    The database runs in WAL mode and only the totals changed since the last save are written, upserted in a
+    single transaction. Existing gametime.bin or gametime.json files are migrated the first time it's loaded.
+    Time played is also bucketed by day in a GameHistory so it can be queried over a window.
+    """
     def __init__(self):
         self.game_data = None
+        self.history = GameHistory()
+        self.leaderboards = None
+        self.analytics = None
+        self.connection = None
+        # (member id, game id) totals changed since the last save
+        self.dirty = set()
+        # Game ids below this are already in the games table
+        self.saved_games = 0
+        # Every database call after loading goes through this one thread, in order
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gametime-writer')
+        # Seconds each save spent writing on the writer thread and blocking the event loop taking its snapshot
+        self.save_times = deque(maxlen=SAVE_HISTORY)
+        self.block_times = deque(maxlen=SAVE_HISTORY)
+
+    def load(self):
+        self.connection = sqlite3.connect(GAMETIME_DB, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # WAL only needs a sync at checkpoints to survive a crash
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+        self.history.load(self.connection)
+
+        self.game_data = GameStore()
+        for game_id, name in self.connection.execute('SELECT game_id, name FROM games ORDER BY game_id'):
+            if self.game_data.intern(name) != game_id:
+                raise ValueError("{} has gaps in its game ids".format(GAMETIME_DB))
+        self.saved_games = len(self.game_data.game_names)
+        for member_id, game_id, seconds in self.connection.execute('SELECT member_id, game_id, seconds FROM gametime'):
+            self.game_data.add_time_by_id(member_id, game_id, seconds)
+
+        if not self.game_data.members:
+            self.migrate()
+        self.leaderboards = Leaderboards.from_store(self.game_data)
+        self.analytics = GameAnalytics(self.game_data)
+
+    def migrate(self):
+        """Copies gametime saved by older versions into the database. """
+        if os.path.isfile(GAMETIME_STORE):
+            with open(GAMETIME_STORE, 'rb') as f:
+                store = GameStore.from_bytes(f.read())
+        elif os.path.isfile(GAMETIME_JSON):
+            store = GameStore.from_dict(load_json(GAMETIME_JSON))
+        else:
+            return
 
-        if not os.path.isfile(GAMETIME_JSON):
-            create_json(GAMETIME_JSON)
-
-    def load_json(self):
-        with open(GAMETIME_JSON, 'r') as f:
-            self.game_data = json.load(f)
-
-    def dump_json(self):
-        with open(GAMETIME_JSON, 'w') as f:
-            json.dump(self.game_data, f)
-
-    def increment_time_played(self, member_id, game, seconds=UPDATE_FREQUENCY):
+        log.info("Migrating {} members' gametime to {}".format(len(store), GAMETIME_DB))
+        for member_id, game, seconds in store.rows():
+            # Lifetime totals only, there's no telling when the time was played
+            member_id = int(member_id)
+            game_id = self.game_data.intern(game)
+            self.game_data.add_time_by_id(member_id, game_id, seconds)
+            self.dirty.add((member_id, game_id))
+        # Older versions created an empty gametime.json, which leaves nothing to write
+        snapshot = self.snapshot()
+        if snapshot is not None:
+            self.write(snapshot)
+
+    def snapshot(self):
+        """Takes the new games and totals changed since the last save and marks them saved, or None if nothing has.
+
+        This is the only part of a save that runs on the event loop, it copies just what changed.
+        """
+        store = self.game_data
+        new_games = [(game_id, store.game_names[game_id]) for game_id in range(self.saved_games,
+                                                                               len(store.game_names))]
+        rows = [(member_id, game_id, store.get_time_by_id(member_id, game_id)) for member_id, game_id in self.dirty]
+        history = self.history.snapshot()
+        self.saved_games = len(store.game_names)
+        self.dirty.clear()
+        if not new_games and not rows and history == (None, []):
+            return None
+        return new_games, rows, history
+
+    def restore(self, snapshot):
+        """Marks a snapshot that failed to save as unsaved again. """
+        new_games, rows, history = snapshot
+        if new_games:
+            self.saved_games = min(self.saved_games, new_games[0][0])
+        self.dirty.update((member_id, game_id) for member_id, game_id, _ in rows)
+        self.history.restore(history)
+
+    def write(self, snapshot):
+        """Writes a snapshot to the database in one transaction, runs on the writer thread. """
+        started = time.perf_counter()
+        new_games, rows, history = snapshot
+        with self.connection:
+            # Games can be written twice when an earlier failed snapshot is restored after a later one saved
+            self.connection.executemany('INSERT OR IGNORE INTO games (game_id, name) VALUES (?, ?)', new_games)
+            self.connection.executemany(UPSERT, rows)
+            GameHistory.write(self.connection, history)
+        log.debug("Saved {} gametime rows and {} new games".format(len(rows), len(new_games)))
+        return time.perf_counter() - started
+
+    async def save(self):
+        """Saves what changed since the last save without blocking the event loop on the database. """
+        started = time.perf_counter()
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return
+        self.block_times.append(time.perf_counter() - started)
+        try:
+            save_time = await asyncio.get_running_loop().run_in_executor(self.writer, self.write, snapshot)
+        except Exception:
+            self.restore(snapshot)
+            raise
+        self.save_times.append(save_time)
+
+    async def close(self):
+        if self.connection is not None:
+            await asyncio.get_running_loop().run_in_executor(self.writer, self.connection.close)
+            self.connection = None
+        self.writer.shutdown()
+
+    def increment_time_played(self, member_id, game, seconds):
         if self.game_data is None:
-            log.critical("Tried incrementing game data before it was loaded from JSON!")
+            log.critical("Tried incrementing game data before it was loaded from storage!")
             return
 
-        # Data loaded from JSON is a string
-        member_id = str(member_id)
-
-        # Try to increment the gametime and build the dictionary tree if game is missing
-        # Kinda gross looking but this is EAFP
-        try:
-            self.game_data[member_id][game] = int(self.game_data[member_id][game]) + seconds
-        except KeyError:
-            log.debug("{} is a brand new game not played before by {}".format(game, member_id))
-            try:
-                self.game_data[member_id][game] = seconds
-            except KeyError:
-                log.debug("{} is {}'s first game played on record".format(game, member_id))
-                self.game_data[member_id] = dict()
-                self.game_data[member_id][game] = seconds
+        member_id = int(member_id)
+        game_id = self.game_data.intern(game)
+        total = self.game_data.add_time_by_id(member_id, game_id, seconds)
+        self.dirty.add((member_id, game_id))
+        self.history.add(member_id, game_id, seconds)
+        self.leaderboards.add(member_id, game_id, seconds, total)
+        self.analytics.invalidate()
+
+    async def get_member_games(self, member_id, days=None):
+        """Returns the member's (game, seconds) pairs from most to least played, over the last days if given. """
+        if days is not None:
+            totals = self.history.member_totals(int(member_id), get_day() - days + 1)
+            return [(self.game_data.game_names[game_id], seconds) for game_id, seconds in totals]
+
+        await self.save()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.writer, lambda: self.connection.execute(MEMBER_GAMES_QUERY, (int(member_id),)).fetchall())
+
+    def stats_string(self):
+        if not self.save_times:
+            return 'No saves yet'
+        return 'last save {:.0f}ms (max {:.0f}ms), loop blocked {:.1f}ms (max {:.1f}ms) over {} saves'.format(
+            self.save_times[-1] * 1000, max(self.save_times) * 1000, self.block_times[-1] * 1000,
+            max(self.block_times) * 1000, len(self.save_times))
+
+    def find_game(self, name):
+        """Returns the id of the game with the name, ignoring case if there's no exact match, or None. """
+        game_id = self.game_data.game_ids.get(name)
+        if game_id is None:
+            name = name.casefold()
+            game_id = next((game_id for game_id, game in enumerate(self.game_data.game_names)
+                            if game.casefold() == name), None)
+        return game_id
 
     def print_game_data(self):
-        pprint(self.game_data)
+        pprint(self.game_data.to_dict())
 
 
 class Gametime(Cog):
@@ -66,66 +242,184 @@ class Gametime(Cog):
     def __init__(self, bot):
         self.bot = bot
         self.game_data = GameData()
-        self.game_data.load_json()
-        self.last_save_time = time.time()
-        self.last_update_time = time.time()
-        self.update_gametime.start()
-
-    @tasks.loop(seconds=UPDATE_FREQUENCY)
-    async def update_gametime(self):
-        """Updates the gametime for each member on the server. """
-        if time.time() - self.last_update_time < UPDATE_FREQUENCY - 1:
-            log.debug("It hasn't been {} seconds since the last update, skipping this update".format(UPDATE_FREQUENCY))
+        self.game_data.load()
+        # Members currently playing something: member id -> game name -> monotonic time the session started
+        self.active_sessions = dict()
+        self.shard_timings = dict()
+        self.save_gametime.start()
+
+    async def cog_unload(self):
+        self.save_gametime.cancel()
+
+    @staticmethod
+    def get_games_playing(member):
+        return {activity.name for activity in member.activities if activity.type == discord.ActivityType.playing}
+
+    def update_member_sessions(self, member, now=None):
+        """Starts and ends the member's game sessions so they match what the member is playing now.
+
+        Members in several guilds get a presence update per guild, comparing against the active sessions rather
+        than the before presence makes the repeats no-ops.
+        """
+        if member.bot:
             return
 
-        already_updated = set()
+        now = now or time.monotonic()
+        games_playing = self.get_games_playing(member)
+        sessions = self.active_sessions.get(member.id, dict())
 
-        for guild in self.bot.guilds:
-            for user in guild.members:
-                if user.bot is True or user.id in already_updated:
-                    continue
+        for game in set(sessions) - games_playing:
+            self.credit_session(member.id, game, now)
+            del sessions[game]
+            log.debug("{} stopped playing {}".format(member.id, game))
 
-                for activity in user.activities:
-                    if activity.type == discord.ActivityType.playing:
-                        self.game_data.increment_time_played(user.id, activity.name)
-                        already_updated.add(user.id)
+        for game in games_playing - set(sessions):
+            sessions[game] = now
+            log.debug("{} started playing {}".format(member.id, game))
 
-        self.last_update_time = time.time()
-        log.debug("Finished updating gametime data")
-        self.save_game_data()
+        if sessions:
+            self.active_sessions[member.id] = sessions
+        else:
+            self.active_sessions.pop(member.id, None)
+
+    def credit_session(self, member_id, game, now):
+        """Credits the whole seconds played since the session started and moves its start up to match. """
+        start = self.active_sessions[member_id][game]
+        seconds = int(now - start)
+        if seconds > 0:
+            self.game_data.increment_time_played(member_id, game, seconds)
+            # Keep the fractional second so repeated checkpoints don't lose time
+            self.active_sessions[member_id][game] = start + seconds
+
+    async def checkpoint_sessions(self):
+        """Credits the time played so far by every active session without ending them, in time sliced chunks. """
+        now = time.monotonic()
+        async for member_id in TimeSlicer().iterate(list(self.active_sessions)):
+            # Presence updates can end sessions while we're yielding
+            for game in list(self.active_sessions.get(member_id, ())):
+                self.credit_session(member_id, game, now)
+
+    def end_unseen_sessions(self, member_ids):
+        """Credits and ends the sessions of members who no longer share a guild with the bot.
+
+        Nothing sends presence updates for them anymore, so their sessions would otherwise never end.
+        """
+        now = time.monotonic()
+        for member_id in member_ids:
+            if member_id not in self.active_sessions or any(guild.get_member(member_id) is not None
+                                                            for guild in self.bot.guilds):
+                continue
+            for game in list(self.active_sessions[member_id]):
+                self.credit_session(member_id, game, now)
+            del self.active_sessions[member_id]
+            log.debug("{} can't be seen anymore, ended their sessions".format(member_id))
+
+    @Cog.listener()
+    async def on_member_remove(self, member):
+        self.end_unseen_sessions([member.id])
+
+    @Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.end_unseen_sessions([member.id for member in guild.members])
+
+    def get_shard_timings(self, shard_id):
+        timings = self.shard_timings.get(shard_id)
+        if timings is None:
+            timings = self.shard_timings[shard_id] = ShardTimings()
+        return timings
+
+    @Cog.listener()
+    async def on_presence_update(self, before, after):
+        started = time.perf_counter()
+        self.update_member_sessions(after)
+        timings = self.get_shard_timings(after.guild.shard_id)
+        timings.presence_time += time.perf_counter() - started
+        timings.presence_updates += 1
+
+    @Cog.listener()
+    async def on_ready(self):
+        """Reconciles the active sessions with everyone's presence, since updates are missed while disconnected.
+
+        Each shard's guilds are reconciled in time sliced chunks, with the shards started evenly spread over
+        RECONCILE_SPREAD seconds so they don't all hit the event loop at once.
+        """
+        now = time.monotonic()
+        seen = set()
+        shards = dict()
+        for guild in self.bot.guilds:
+            shards.setdefault(guild.shard_id, list()).append(guild)
+
+        reconciles = [self.reconcile_shard(shard_id, guilds, now, seen, index * RECONCILE_SPREAD / len(shards))
+                      for index, (shard_id, guilds) in enumerate(sorted(shards.items()))]
+        await asyncio.gather(*reconciles)
+        log.debug("Tracking {} members currently playing games".format(len(self.active_sessions)))
+
+    async def reconcile_shard(self, shard_id, guilds, now, seen, delay):
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        slicer = TimeSlicer()
+        reconciled = 0
+        members = (member for guild in guilds for member in guild.members)
+        async for member in slicer.iterate(members):
+            # Members in guilds on several shards only need reconciling once
+            if member.id not in seen:
+                seen.add(member.id)
+                reconciled += 1
+                self.update_member_sessions(member, now)
+
+        timings = self.get_shard_timings(shard_id)
+        timings.reconcile_time = slicer.busy
+        timings.reconcile_wall_time = time.perf_counter() - started
+        timings.reconciled = reconciled
+        log.debug(timings.to_string(shard_id))
+
+    @tasks.loop(seconds=SAVE_FREQUENCY)
+    async def save_gametime(self):
+        """Saves the current gametime data to storage. """
+        await self.save_game_data()
 
-    @update_gametime.before_loop
+    @save_gametime.before_loop
     async def before_gametime(self):
         await self.bot.wait_until_ready()
 
-    @update_gametime.after_loop
-    async def save_gametime(self):
-        """Saves the current gametime data to storage. """
-        self.save_game_data(force=True)
+    @save_gametime.after_loop
+    async def after_gametime(self):
+        await self.save_game_data()
+        await self.game_data.close()
 
-    def save_game_data(self, force=False):
-        time_now = time.time()
-        if time_now - self.last_save_time >= SAVE_FREQUENCY or force:
-            log.debug("Saving gamedata to Storage")
-            self.game_data.dump_json()
-            self.last_save_time = time_now
+    async def save_game_data(self):
+        log.debug("Saving gamedata to Storage")
+        await self.checkpoint_sessions()
+        await self.game_data.save()
+
+    def stats_fields(self):
+        """Returns (name, value) pairs describing gametime storage for the !stats embed. """
+        fields = [('Gametime Saves', self.game_data.stats_string())]
+        if self.shard_timings:
+            fields.append(('Gametime Shards', '\n'.join(timings.to_string(shard_id) for shard_id, timings
+                                                         in sorted(self.shard_timings.items()))))
+        return fields
 
     @commands.command()
-    async def played(self, ctx):
+    async def played(self, ctx, window=None):
         """Prints the time played for every game Pooper has detected.
 
-        Ordered from most played to least played game.
+        Ordered from most played to least played game. Pass a window like 7d, 2w, 3m or 1y (or today, week,
+        month, year) to only count time played in that window.
         """
+        days = None
+        if window is not None:
+            days = parse_window(window)
+            if days is None:
+                await ctx.send("I don't know how long {} is, try something like 7d, 2w, 3m or 1y".format(window))
+                return
+
         async with ctx.typing():
-            member_id = str(ctx.author.id)
-            try:
-                member_data = self.game_data.game_data[member_id]
-            except KeyError:
+            sorted_member_data = await self.game_data.get_member_games(ctx.author.id, days)
+            if not sorted_member_data:
                 await ctx.send("I scooped a lot but couldn't find any of your data!")
                 return
 
-            sorted_member_data = dict(sorted(member_data.items(), key=lambda item: int(item[1]), reverse=True))
-
             items_added = 0
             total_items_added = 0
             items = len(sorted_member_data)
@@ -133,20 +427,21 @@ class Gametime(Cog):
             total_messages = items // max_embed + 1
             current_message = 1
             embeds_list = list()
-            current_embed = discord.Embed(title=f'Time Played (On Discord) 🎮 {current_message}/{total_messages}',
+            title = 'Time Played (On Discord) 🎮' if window is None else f'Time Played in {window} (On Discord) 🎮'
+            current_embed = discord.Embed(title=f'{title} {current_message}/{total_messages}',
                                           colour=discord.Colour.blue())
 
-            for game in sorted_member_data:
+            for game, seconds in sorted_member_data:
                 if items_added >= max_embed:
                     total_items_added += items_added
                     items_added = 0
                     current_message = total_items_added // max_embed + 1
                     embeds_list.append(current_embed)
-                    current_embed = discord.Embed(title=f'Time Played (On Discord) 🎮 {current_message}/{total_messages}',
+                    current_embed = discord.Embed(title=f'{title} {current_message}/{total_messages}',
                                                   colour=discord.Colour.blue())
                     print('adding to current embed list')
 
-                gametime = self.convert_seconds_to_string(int(member_data[game]))
+                gametime = self.convert_seconds_to_string(seconds)
                 current_embed.add_field(name=game, value=gametime, inline=False)
                 items_added += 1
 
@@ -155,6 +450,129 @@ class Gametime(Cog):
             for embed in embeds_list:
                 await ctx.send(embed=embed)
 
+    @commands.command()
+    async def leaderboard(self, ctx, *, game=None):
+        """Prints the members who have played the most, overall or of a single game. """
+        if game is None:
+            title = 'Most Time Played 🏆'
+            ranking = self.game_data.leaderboards.member_leaderboard()
+        else:
+            game_id = self.game_data.find_game(game)
+            if game_id is None:
+                await ctx.send("Nobody has played {} yet!".format(game))
+                return
+            title = 'Most Time Played in {} 🏆'.format(self.game_data.game_data.game_names[game_id])
+            ranking = self.game_data.leaderboards.game_leaderboard(game_id)
+
+        embed = discord.Embed(title=title, colour=discord.Colour.gold())
+        for position, (member_id, seconds) in enumerate(ranking, 1):
+            user = self.bot.get_user(member_id)
+            name = user.display_name if user is not None else str(member_id)
+            embed.add_field(name='{}. {}'.format(position, name), value=self.convert_seconds_to_string(seconds),
+                            inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.command(name='top-games')
+    async def top_games(self, ctx):
+        """Prints the games everyone has played the most. """
+        embed = discord.Embed(title='Most Played Games 🏆', colour=discord.Colour.gold())
+        for position, (game_id, seconds) in enumerate(self.game_data.leaderboards.game_ranking(), 1):
+            embed.add_field(name='{}. {}'.format(position, self.game_data.game_data.game_names[game_id]),
+                            value=self.convert_seconds_to_string(seconds), inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.command(name='game-stats')
+    async def game_stats(self, ctx, *, game):
+        """Prints how long people play a game and which games its players also play. """
+        game_id = self.game_data.find_game(game)
+        if game_id is None:
+            await ctx.send("Nobody has played {} yet!".format(game))
+            return
+
+        async with ctx.typing():
+            analytics = self.game_data.analytics
+            await analytics.refresh()
+            players, median, mean = analytics.game_summary(game_id)
+            embed = discord.Embed(title='{} Stats 📊'.format(self.game_data.game_data.game_names[game_id]),
+                                  colour=discord.Colour.blue())
+            embed.add_field(name='Players', value=str(players), inline=True)
+            embed.add_field(name='Median Time Played', value=self.convert_seconds_to_string(median), inline=False)
+            embed.add_field(name='Average Time Played', value=self.convert_seconds_to_string(mean), inline=False)
+
+            correlated = ['{} ({:.2f})'.format(self.game_data.game_data.game_names[other], correlation)
+                          for other, correlation in analytics.coplay_correlations(game_id) if correlation > 0]
+            if correlated:
+                embed.add_field(name='Also Played With', value='\n'.join(correlated), inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    async def rank(self, ctx, *, game=None):
+        """Prints the percentage of players you've played more than, overall or of a single game. """
+        game_id = None
+        if game is not None:
+            game_id = self.game_data.find_game(game)
+            if game_id is None:
+                await ctx.send("Nobody has played {} yet!".format(game))
+                return
+
+        async with ctx.typing():
+            await self.game_data.analytics.refresh()
+            percentile = self.game_data.analytics.percentile_rank(ctx.author.id, game_id)
+        if percentile is None:
+            await ctx.send("I scooped a lot but couldn't find any of your data!")
+            return
+        what = 'everyone' if game_id is None else 'everyone who plays {}'.format(
+            self.game_data.game_data.game_names[game_id])
+        await ctx.send("You've played more than {:.1f}% of {}".format(percentile, what))
+
+    @commands.is_owner()
+    @commands.command()
+    async def analytics(self, ctx):
+        """Owner-only. Prints the state of the gametime analytics matrix, rebuilding it if it's stale. """
+        async with ctx.typing():
+            await self.game_data.analytics.refresh()
+            embed = discord.Embed(title='Gametime Analytics 📊', colour=discord.Colour.blue(),
+                                  description=self.game_data.analytics.stats_string())
+        await ctx.send(embed=embed)
+
+    @commands.is_owner()
+    @commands.command(name='export-gametime')
+    async def export_gametime(self, ctx, fmt='csv', compress: bool = False):
+        """Owner-only. Exports every gametime total as csv, jsonl or parquet, optionally compressed.
+
+        The file is uploaded if it's small enough, otherwise it's left in the gametime_exports folder.
+        """
+        if fmt not in EXPORT_FORMATS:
+            await ctx.send("I can only export {}".format(', '.join(EXPORT_FORMATS)))
+            return
+
+        async with ctx.typing():
+            await self.save_game_data()
+            if not os.path.isdir(GAMETIME_EXPORT_DIR):
+                os.makedirs(GAMETIME_EXPORT_DIR)
+            name = 'gametime-{}'.format(time.strftime('%Y%m%d-%H%M%S'))
+            path = os.path.join(GAMETIME_EXPORT_DIR, get_filename(name, fmt, compress))
+
+            def run_export():
+                # A separate read only connection so the export doesn't hold up saves on the writer thread
+                connection = connect_read_only(GAMETIME_DB)
+                try:
+                    return export(connection, path, fmt, compress)
+                finally:
+                    connection.close()
+
+            try:
+                rows = await asyncio.to_thread(run_export)
+            except RuntimeError as e:
+                await ctx.send(str(e))
+                return
+
+        limit = ctx.guild.filesize_limit if ctx.guild is not None else DEFAULT_UPLOAD_LIMIT
+        if os.path.getsize(path) <= limit:
+            await ctx.send("Exported {} rows".format(rows), file=discord.File(path))
+        else:
+            await ctx.send("Exported {} rows to {}, it's too big to upload".format(rows, path))
+
     def convert_seconds_to_string(self, seconds):
         hours, remainder = divmod(seconds, SECONDS_IN_HOUR)
         minutes, seconds = divmod(remainder, MINUTES_IN_HOUR)
@@ -169,8 +587,7 @@ class Gametime(Cog):
     @commands.command()
     async def save(self, ctx):
         """Force saves the gametime data to storage. This is automatic. """
-        self.update_gametime.cancel()
-        self.update_gametime.restart()
+        await self.save_game_data()
         await ctx.message.add_reaction('👍')
 
 
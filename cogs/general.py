@@ -119,6 +119,16 @@ class General(Cog):
                 value += '{}, '.format(cog)
             embed.add_field(name=name, value=value.rstrip(', '), inline=True)
 
+            music = self.bot.get_cog('Music')
+            if music is not None:
+                for name, value in music.stats_fields():
+                    embed.add_field(name=name, value=value, inline=False)
+
+            gametime = self.bot.get_cog('Gametime')
+            if gametime is not None:
+                for name, value in gametime.stats_fields():
+                    embed.add_field(name=name, value=value, inline=False)
+
             await ctx.send(embed=embed)
 
     @commands.command()
@@ -1,13 +1,24 @@
 import asyncio
 import discord
+import io
+import json
 import logging
 import random
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+import sys
+import time
+from collections import deque
 import yt_dlp as youtube_dl
 from discord.ext import commands, tasks
 from discord.ext.commands import Cog
+from cogs.utils.audiocache import BYTES_IN_MEGABYTE, AudioCache
+from cogs.utils.cache import TTLCache
+from cogs.utils.extractor import FLAT_OPTIONS, ExtractorPool
+from cogs.utils.musicqueue import MusicQueue
+from cogs.utils.resolver import HedgedResolver
+from cogs.utils.telemetry import StreamTelemetry
+from cogs.utils.spotify import YOUTUBE_VIDEO_URL, SpotifyClient, SpotifyError, TrackIndex, track_key, track_query
 from cogs.utils.utils import load_credentials
+from urllib.parse import parse_qs, urlparse
 
 
 log = logging.getLogger(__name__)
@@ -29,127 +40,695 @@ ffmpeg_options = {
     'options': '-vn',
     'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
 }
+# Files from the audio cache are local, so there's nothing to reconnect to
+local_ffmpeg_options = {
+    'options': '-vn'
+}
 
+# Only used for filename templating, extraction goes through the worker pool
 ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
-ONE_MEMBER = 1
 credentials = load_credentials()
 DEFAULT_VOLUME = 0.15
+# Seconds the bot waits in a voice channel with nobody else in it before disconnecting
+IDLE_DISCONNECT_DELAY = credentials.get('music_idle_timeout', 30)
+
+# In Opus passthrough mode full volume means ffmpeg can copy Opus streams without touching them
+OPUS_PASSTHROUGH = credentials.get('music_opus_passthrough', False)
+OPUS_DEFAULT_VOLUME = 1.0
+OPUS_FRAME_SECONDS = 0.02
+
+# Number of upcoming queue entries resolved in the background while a song plays
+PREFETCH_DEPTH = credentials.get('music_prefetch_depth', 2)
+# Seconds before a signed stream url expires that we treat it as already expired
+STREAM_EXPIRY_MARGIN = 60
+# Lifetime assumed for stream urls that don't advertise an expiry
+DEFAULT_STREAM_TTL = 3600
+# Number of flat searches each guild runs at once for newly queued songs
+LOOKUP_CONCURRENCY = 2
+QUEUE_PAGE_SIZE = 10
+# Seconds before the current song ends that the next song's ffmpeg is started
+PRELOAD_AHEAD = credentials.get('music_preload_seconds', 10)
+# Audio buffered from the next song's ffmpeg before the current one ends, in 20ms frames
+PRELOAD_FRAMES = 150
+# Number of inter-track gaps each session keeps for reporting
+GAP_HISTORY = 50
+# Number of finished songs each session keeps pipeline telemetry for
+TELEMETRY_HISTORY = 20
+
+# Player states
+IDLE = 'idle'
+RESOLVING = 'resolving'
+PLAYING = 'playing'
+PAUSED = 'paused'
+STOPPING = 'stopping'
+PLAYER_TRANSITIONS = {
+    IDLE: (RESOLVING, STOPPING),
+    RESOLVING: (PLAYING, IDLE, STOPPING),
+    PLAYING: (PAUSED, IDLE, STOPPING),
+    PAUSED: (PLAYING, IDLE, STOPPING),
+    STOPPING: (),
+}
+# Number of state transitions each session keeps for latency analysis
+TRANSITION_HISTORY = 200
+
+extractor_pool = ExtractorPool(ytdl_format_options, workers=credentials.get('ytdl_workers', 4),
+                               use_processes=credentials.get('ytdl_use_processes', False))
+
+# Extracted stream data keyed by normalized query, shared across every guild
+extraction_cache = TTLCache(max_entries=credentials.get('music_cache_size', 256))
+
+
+
+def search_provider(search_prefix):
+    """Returns a fetch function for the resolver that flat searches with a yt-dlp search prefix. """
+    async def fetch(query):
+        return await YTDLSource.search('{}1:{}'.format(search_prefix, query))
+    return fetch
+
+
+# Free text searches try each provider in order, racing the next one when a search is slow
+search_providers = credentials.get('music_search_providers', ['ytsearch', 'scsearch'])
+search_resolver = HedgedResolver([(prefix, search_provider(prefix)) for prefix in search_providers],
+                                 hedge_delay=credentials.get('music_hedge_delay', 2.0))
+
+audio_cache = AudioCache(extractor_pool, ytdl_format_options['outtmpl'],
+                         enabled=credentials.get('audio_cache_enabled', False),
+                         min_plays=credentials.get('audio_cache_min_plays', 3),
+                         max_bytes=credentials.get('audio_cache_max_mb', 1024) * BYTES_IN_MEGABYTE)
+
+
+def is_url(query):
+    """Whether a query is a web url rather than a search, free text like "Re: Stacks" also parses a scheme. """
+    parsed = urlparse(query)
+    return parsed.scheme in ('http', 'https') and bool(parsed.netloc)
+
+
+def normalize_query(query):
+    """Normalizes a url or search query so equivalent requests share an extraction cache entry. """
+    query = ' '.join(query.split())
+    # Urls (video ids in particular) are case sensitive, free text searches are not
+    if is_url(query):
+        return query
+    return query.lower()
+
+
+def deep_getsizeof(value):
+    """Approximate bytes used by a value made of nested dicts, lists and scalars, like extracted info. """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_getsizeof(key) + deep_getsizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_getsizeof(item) for item in value)
+    return size
+
+
+def get_stream_expiry(data):
+    """Returns the unix time at which the signed stream url in the extracted data stops working. """
+    query = parse_qs(urlparse(data.get('url') or '').query)
+    try:
+        return int(query['expire'][0])
+    except (KeyError, IndexError, ValueError):
+        return time.time() + DEFAULT_STREAM_TTL
 
 
 class MusicEntry:
-    def __init__(self, url, voice_client, ctx, player=None):
+    """A queued song. Only IDs are kept, the live Discord objects are looked up when it's played. """
+    __slots__ = ('url', 'requester_id', 'channel_id', 'player', 'entry_id', 'index_key', 'title', 'duration',
+                 'lookup_task', 'data', 'expires_at', 'resolve_task', 'requested_at', 'extract_time')
+
+    def __init__(self, url, requester_id, channel_id, player=None, index_key=None):
         self.player = player
-        self.voice_client = voice_client
-        self.ctx = ctx
         self.url = url
+        self.requester_id = requester_id
+        # Text channel the song was requested from
+        self.channel_id = channel_id
+        # Assigned by the MusicQueue when the entry is queued
+        self.entry_id = None
+        # Key of the Spotify track this entry was searched for, if any
+        self.index_key = index_key
+
+        # Lightweight metadata from the flat search done when the entry is queued
+        self.title = None
+        self.duration = None
+        self.lookup_task = None
+
+        # Extracted stream data, filled in ahead of time by prefetching
+        self.data = None
+        self.expires_at = 0
+        self.resolve_task = None
+
+        # Pipeline timings handed to the player's telemetry
+        self.requested_at = None
+        self.extract_time = None
+
+    def memory_size(self):
+        """Approximate bytes used by the entry while it waits in the queue. """
+        size = sys.getsizeof(self)
+        for slot in ('url', 'index_key', 'title'):
+            value = getattr(self, slot)
+            if value is not None:
+                size += sys.getsizeof(value)
+        if self.data is not None:
+            # Prefetched stream data, the formats list makes up most of it
+            size += deep_getsizeof(self.data)
+        return size
+
+    def display_name(self):
+        name = self.title or self.url
+        if self.duration:
+            minutes, seconds = divmod(int(self.duration), 60)
+            name += ' ({}:{:02d})'.format(minutes, seconds)
+        return name
+
+    def needs_lookup(self):
+        # Urls already point at a video, only free text searches need the flat search
+        return self.title is None and not is_url(self.url)
+
+    async def lookup(self):
+        """Runs a flat search for the entry's query and points the entry at the first result's video. """
+        result = await search_resolver.resolve(self.url)
+        self.title = result.get('title')
+        self.duration = result.get('duration')
+        self.url = result.get('url') or YOUTUBE_VIDEO_URL.format(result['id'])
+
+    def is_resolved(self):
+        return self.data is not None and time.time() < self.expires_at - STREAM_EXPIRY_MARGIN
+
+    def prefetch(self, loop):
+        """Starts resolving the entry in the background if it isn't resolved or resolving already. """
+        if audio_cache.contains(normalize_query(self.url)):
+            return
+        if self.resolve_task is None and not self.is_resolved():
+            self.resolve_task = loop.create_task(self._prefetch(loop))
+
+    async def ensure_looked_up(self):
+        """Makes sure a free text entry has been searched for before it's extracted. """
+        if self.lookup_task is not None:
+            await self.lookup_task
+        if self.needs_lookup():
+            # The background search failed or never ran, so run it now
+            await self.lookup()
+
+    async def _prefetch(self, loop):
+        try:
+            await self.ensure_looked_up()
+            await self._extract(loop)
+        except Exception as e:
+            # Not fatal, resolve() tries again when the entry is about to be played
+            log.debug('Failed to prefetch {}: {}'.format(self.url, e))
+        finally:
+            self.resolve_task = None
+
+    async def _extract(self, loop):
+        started = time.perf_counter()
+        self.data = await YTDLSource.extract(self.url, loop=loop, stream=True)
+        self.extract_time = time.perf_counter() - started
+        self.expires_at = get_stream_expiry(self.data)
+
+    async def resolve(self, loop):
+        """Returns the entry's stream data, re-resolving it if it was never fetched or has expired. """
+        # The full extraction should use the video the flat search found
+        await self.ensure_looked_up()
+
+        task = self.resolve_task
+        if task is not None:
+            # Let an in-flight prefetch finish rather than extracting the same url twice
+            await task
+
+        if not self.is_resolved():
+            await self._extract(loop)
+        return self.data
+
+    async def create_player(self, loop, volume):
+        """Creates the audio source for the entry, from the local audio cache when it's there. """
+        await self.ensure_looked_up()
+
+        source_class = YTDLOpusSource if OPUS_PASSTHROUGH else YTDLSource
+        key = normalize_query(self.url)
+        cached = await audio_cache.get(key)
+        if cached is not None:
+            path, self.data = cached
+            player = await source_class.create(self.data, filename=path, volume=volume)
+        else:
+            player = await source_class.create(await self.resolve(loop), volume=volume)
+
+        player.telemetry.requested_at = self.requested_at
+        player.telemetry.extract_time = None if cached is not None else self.extract_time
+        # Only the first play of an entry is measured from the request
+        self.requested_at = None
+
+        audio_cache.record_play(key, loop)
+        return player
+
+
+class FrameBuffer:
+    """Holds audio frames read from a source ahead of time, so playback starts without waiting on ffmpeg. """
+    def __init__(self, read, telemetry):
+        self._source_read = read
+        self._frames = deque()
+        self.telemetry = telemetry
+
+    def _read(self):
+        frame = self._source_read()
+        if frame:
+            self.telemetry.on_ffmpeg_frame()
+        return frame
+
+    def __len__(self):
+        return len(self._frames)
+
+    def fill(self, count):
+        """Reads up to count frames from the source. Blocks on ffmpeg, so run it in an executor. """
+        for _ in range(count):
+            frame = self._read()
+            self._frames.append(frame)
+            if not frame:
+                break
+
+    def read(self):
+        if self._frames:
+            return self._frames.popleft()
+        return self._read()
+
+
+class BufferedAudio(discord.AudioSource):
+    """Wraps a PCM source with a FrameBuffer so it can be primed before it's played. """
+    def __init__(self, source, telemetry):
+        self.source = source
+        self.buffer = FrameBuffer(source.read, telemetry)
+
+    def read(self):
+        return self.buffer.read()
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
 
 
 class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=DEFAULT_VOLUME):
-        super().__init__(source, volume)
+    def __init__(self, source, *, data, volume=DEFAULT_VOLUME, telemetry=None):
+        self.telemetry = telemetry or StreamTelemetry(data.get('title'))
+        self.telemetry.process = getattr(source, '_process', None)
+        # Buffer the raw PCM so the volume is still applied when the audio is actually played
+        buffered = BufferedAudio(source, self.telemetry)
+        super().__init__(buffered, volume)
+        self.buffer = buffered.buffer
         self.data = data
         self.title = data.get('title')
         self.url = data.get('url')
 
+    def read(self):
+        started = time.perf_counter()
+        ret = super().read()
+        self.telemetry.on_read(started, time.perf_counter(), ret)
+        return ret
+
+    def cleanup(self):
+        self.telemetry.finish()
+        super().cleanup()
+
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
+    async def extract(cls, url, *, loop=None, stream=False):
+        key = normalize_query(url)
+        if stream:
+            data = extraction_cache.get(key)
+            if data is not None:
+                return data
+
+        data = await extractor_pool.extract_info(url, download=not stream, loop=loop)
 
         if 'entries' in data:
             # take first item from a playlist
             data = data['entries'][0]
 
+        if stream:
+            extraction_cache.put(key, data, get_stream_expiry(data) - STREAM_EXPIRY_MARGIN)
+        return data
+
+    @classmethod
+    async def search(cls, query, *, loop=None):
+        """Returns the id, title and duration of the first search result without extracting its formats. """
+        data = await extractor_pool.extract_info(query, overrides=FLAT_OPTIONS, loop=loop)
+        if data is None:
+            return None
+        if 'entries' in data:
+            entries = list(data['entries'])
+            return entries[0] if entries else None
+        return data
+
+    @classmethod
+    def from_data(cls, data, *, stream=False, filename=None):
+        # Started before ffmpeg is spawned so its startup time includes the spawn
+        telemetry = StreamTelemetry(data.get('title'))
+        if filename is not None:
+            return cls(discord.FFmpegPCMAudio(filename, **local_ffmpeg_options), data=data, telemetry=telemetry)
+
         filename = data['url'] if stream else ytdl.prepare_filename(data)
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
+        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data, telemetry=telemetry)
 
+    @classmethod
+    async def from_url(cls, url, *, loop=None, stream=False):
+        data = await cls.extract(url, loop=loop, stream=stream)
+        return cls.from_data(data, stream=stream)
 
-class Music(Cog):
-    """Commands for playing music in voice chat. """
+    @classmethod
+    async def create(cls, data, *, filename=None, volume=DEFAULT_VOLUME):
+        """Creates a streaming source for the data, or a local one when filename is given. """
+        source = cls.from_data(data, stream=True, filename=filename)
+        source.volume = volume
+        return source
 
-    def __init__(self, bot):
+
+class YTDLOpusSource(discord.FFmpegOpusAudio):
+    """Sends Opus to Discord straight from ffmpeg instead of decoding to PCM and re-encoding it in Python.
+
+    Opus sources are copied untouched at full volume. Any other volume is applied by ffmpeg, so changing it
+    restarts ffmpeg from where the song currently is.
+    """
+    def __init__(self, filename, *, data, codec, volume=OPUS_DEFAULT_VOLUME, local=False, start=0.0):
+        self.data = data
+        self.title = data.get('title')
+        self.url = data.get('url')
+        self.filename = filename
+        self.source_codec = codec
+        self.local = local
+        self.start = start
+        self.frames = 0
+        self._volume = volume
+        self.telemetry = StreamTelemetry(self.title)
+
+        options = dict(local_ffmpeg_options if local else ffmpeg_options)
+        if start:
+            options['before_options'] = '{} -ss {:.2f}'.format(options.get('before_options', ''), start).strip()
+        # FFmpegOpusAudio stream copies when given an Opus codec name and encodes with libopus for anything else
+        if volume == OPUS_DEFAULT_VOLUME and codec == 'opus':
+            ffmpeg_codec = 'opus'
+        else:
+            ffmpeg_codec = None
+            if volume != OPUS_DEFAULT_VOLUME:
+                options['options'] += ' -filter:a volume={:.2f}'.format(volume)
+        super().__init__(filename, codec=ffmpeg_codec, **options)
+        self.telemetry.process = getattr(self, '_process', None)
+        self.buffer = FrameBuffer(super().read, self.telemetry)
+
+    @classmethod
+    async def create(cls, data, *, filename=None, volume=OPUS_DEFAULT_VOLUME):
+        """Creates a streaming source for the data, or a local one when filename is given. """
+        local = filename is not None
+        filename = filename if local else data['url']
+        # yt-dlp usually tells us the codec, only fall back to ffprobe when it didn't
+        codec = data.get('acodec')
+        if not codec or codec == 'none':
+            codec, _ = await cls.probe(filename)
+        return cls(filename, data=data, codec=codec, volume=volume, local=local)
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @property
+    def elapsed(self):
+        return self.start + self.frames * OPUS_FRAME_SECONDS
+
+    def read(self):
+        started = time.perf_counter()
+        packet = self.buffer.read()
+        self.telemetry.on_read(started, time.perf_counter(), packet)
+        if packet:
+            self.frames += 1
+        return packet
+
+    def cleanup(self):
+        self.telemetry.finish()
+        super().cleanup()
+
+    def with_volume(self, volume):
+        """Returns a new source that picks up where this one is with ffmpeg applying the new volume. """
+        return YTDLOpusSource(self.filename, data=self.data, codec=self.source_codec, volume=volume,
+                              local=self.local, start=self.elapsed)
+
+
+class MusicSession:
+    """Playback state for a single guild: the queue, player controls and the worker task. """
+
+    def __init__(self, bot, guild_id, track_index):
         self.bot = bot
-        self.music_queue = asyncio.Queue()
-        self.next_song = asyncio.Event()
-        self.music_player.start()
-        self.idle_timeout.start()
-        client_id = credentials['spotify_client_id']
-        client_secret = credentials['spotify_secret']
-        auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
-        self.spotipy = spotipy.Spotify(auth_manager=auth_manager)
+        self.guild_id = guild_id
+        self.track_index = track_index
+        self.music_queue = MusicQueue()
+        self.track_finished = asyncio.Event()
+        self.state = IDLE
+        self.transitions = deque(maxlen=TRANSITION_HISTORY)
+        self.player_task = None
+        self.lookup_semaphore = asyncio.Semaphore(LOOKUP_CONCURRENCY)
+        self.lookup_tasks = set()
+        # Where the last play request came from, for messages not tied to a song
+        self.text_channel = None
 
         # Player Control Variables
         self.repeat_enabled = False
         self.repeated_entry = None
         self.loop_enabled = False
+        self.volume = OPUS_DEFAULT_VOLUME if OPUS_PASSTHROUGH else DEFAULT_VOLUME
+
+        # Gapless playback: the next song's player, started before the current song ends
+        self.preloaded = None
+        self.preload_task = None
+        self.preloading = False
+        self.track_ended_at = None
+        self.gaps = deque(maxlen=GAP_HISTORY)
+
+        # Audio pipeline telemetry
+        self.now_playing = None
+        self.telemetry_history = deque(maxlen=TELEMETRY_HISTORY)
+
+    def start(self):
+        self.player_task = self.bot.loop.create_task(self.music_player())
+
+    def stop(self):
+        self.transition(STOPPING)
+        self.clear_queue()
+        for task in self.lookup_tasks:
+            task.cancel()
+        self.discard_preloaded()
+        if self.player_task is not None:
+            self.player_task.cancel()
+            self.player_task = None
+
+    def lookup_entries(self, entries):
+        """Starts cheap flat searches for newly queued entries so their titles are known right away. """
+        for entry in entries:
+            if entry.needs_lookup():
+                task = self.bot.loop.create_task(self._lookup(entry))
+                entry.lookup_task = task
+                self.lookup_tasks.add(task)
+                task.add_done_callback(self.lookup_tasks.discard)
+
+    async def _lookup(self, entry):
+        try:
+            async with self.lookup_semaphore:
+                await entry.lookup()
+        except Exception as e:
+            # Not fatal, the full extraction will run the search itself
+            log.debug('Flat search failed for {}: {}'.format(entry.url, e))
+        finally:
+            entry.lookup_task = None
+
+    def clear_queue(self):
+        self.music_queue.clear()
+
+    def prefetch_upcoming(self):
+        """Resolves the next few queued entries in the background so they're ready when their turn comes. """
+        for entry in self.music_queue.peek(PREFETCH_DEPTH):
+            entry.prefetch(self.bot.loop)
 
     async def reset_player_controls(self):
         self.repeat_enabled = False
         self.repeated_entry = None
         self.loop_enabled = False
+        self.volume = OPUS_DEFAULT_VOLUME if OPUS_PASSTHROUGH else DEFAULT_VOLUME
 
-    async def get_entry(self):
-        # If repeat is enabled get the stored repeated entry if there is one
+    async def next_entry(self):
+        """Waits for and returns the next entry to play, applying repeat and loop. """
+        # If repeat is enabled keep playing the stored repeated entry if there is one
+        if self.repeat_enabled and self.repeated_entry:
+            return self.repeated_entry
+
+        entry = await self.music_queue.get()
         if self.repeat_enabled:
-            entry = self.repeated_entry if self.repeated_entry else await self.music_queue.get()
-            if not self.repeated_entry:
-                self.repeated_entry = entry
-        else:
-            entry = await self.music_queue.get()
+            self.repeated_entry = entry
+        elif self.loop_enabled:
+            # If loop is enabled, put it back into the queue
+            self.music_queue.put_nowait(entry)
         return entry
 
-    @tasks.loop(seconds=1)
-    async def music_player(self):
-        self.next_song.clear()
-        entry = await self.get_entry()
-
-        # If loop is enabled, put it back into the queue
-        if self.loop_enabled and not self.repeat_enabled:
-            await self.music_queue.put(entry)
-
-        if await self.bot_is_alone(entry.ctx):
+    def transition(self, state):
+        """Moves the player to a new state, timestamping the change for latency analysis. """
+        if state == self.state:
             return
+        if state not in PLAYER_TRANSITIONS[self.state]:
+            log.warning('Unexpected player transition {} -> {} for guild {}'.format(self.state, state, self.guild_id))
+        log.debug('Player for guild {}: {} -> {}'.format(self.guild_id, self.state, state))
+        self.transitions.append((time.perf_counter(), self.state, state))
+        self.state = state
+
+    def time_in_state(self, state):
+        """Returns the durations of completed visits to a state from the recorded transitions. """
+        durations = list()
+        entered_at = None
+        for timestamp, old_state, new_state in self.transitions:
+            if old_state == state and entered_at is not None:
+                durations.append(timestamp - entered_at)
+            entered_at = timestamp if new_state == state else None
+        return durations
 
+    async def music_player(self):
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await self.play_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception('Music player for guild {} hit an error: {}'.format(self.guild_id, e))
+
+    async def play_next(self):
+        """Runs the player through one song: idle until an entry is queued, resolve it, then play it. """
+        self.transition(IDLE)
+        if self.music_queue.empty() and not (self.repeat_enabled and self.repeated_entry):
+            # Waiting on someone to queue a song isn't a gap between tracks
+            self.track_ended_at = None
+        entry = await self.next_entry()
+
+        self.transition(RESOLVING)
         try:
-            entry.player = await YTDLSource.from_url(entry.url, loop=self.bot.loop, stream=True)
-            embed = self.now_playing_embed(entry)
-            await entry.ctx.send(embed=embed)
-            entry.voice_client.play(entry.player, after=self.play_next_entry)
-            # If repeat was enabled, make sure that we store the current entry to the repeated entry
-            if self.repeat_enabled:
-                self.repeated_entry = entry
+            entry.player = await self.get_player(entry)
+            data = entry.player.data
+            if entry.index_key and data.get('extractor_key') == 'Youtube':
+                # Remember which video this Spotify track ended up as, so next time it skips the search
+                self.track_index.add(entry.index_key, data['id'])
+            self.track_finished.clear()
+            voice_client = self.bot.get_guild(self.guild_id).voice_client
+            voice_client.play(entry.player, after=self.on_track_end)
         except Exception as e:
-            await self.error_playing_embed(entry)
+            log.warning('Failed to play {}: {}'.format(entry.url, e))
             # If there was an error playing the song for some reason skip to the next song
             self.repeated_entry = None
-            self.play_next_entry(e)
-
-        await self.next_song.wait()
-
-    @tasks.loop(seconds=30)
-    async def idle_timeout(self):
-        for voice_client in self.bot.voice_clients:
-            if len(voice_client.channel.voice_states) <= ONE_MEMBER:
-                await voice_client.disconnect()
+            await self.error_playing_embed(entry)
+            return
 
-    @idle_timeout.before_loop
-    async def before_timeout(self):
-        await self.bot.wait_until_ready()
+        self.transition(PLAYING)
+        self.now_playing = entry
+        self.record_gap()
+        self.prefetch_upcoming()
+        self.schedule_preload(entry)
+        try:
+            embed = self.now_playing_embed(entry)
+            await self.bot.get_channel(entry.channel_id).send(embed=embed)
+        except discord.HTTPException as e:
+            log.warning('Failed to send the now playing message: {}'.format(e))
+
+        await self.track_finished.wait()
+        self.now_playing = None
+        self.telemetry_history.append(entry.player.telemetry.to_dict())
+        # Looped and repeated entries go back in the queue, so drop the dead source and the full extraction,
+        # a replay gets its stream data from the extraction cache
+        entry.player = None
+        entry.data = None
+        entry.expires_at = 0
+
+    def telemetry_dump(self):
+        """Returns the session's audio pipeline telemetry as plain data. """
+        current = self.now_playing.player.telemetry.to_dict() if self.now_playing is not None else None
+        return {
+            'guild_id': self.guild_id,
+            'state': self.state,
+            'current': current,
+            'history': list(self.telemetry_history),
+            'gaps': [round(gap, 4) for gap in self.gaps],
+        }
+
+    def pause(self, voice_client):
+        if self.state == PLAYING:
+            voice_client.pause()
+            self.transition(PAUSED)
+
+    def resume(self, voice_client):
+        if self.state == PAUSED:
+            voice_client.resume()
+            self.transition(PLAYING)
+
+    async def get_player(self, entry):
+        """Returns the preloaded player if it's for this entry, otherwise creates one now. """
+        task = self.preload_task
+        if task is not None and not task.done():
+            if self.preloading:
+                # Already starting ffmpeg for the next song, finishing that is quicker than starting over
+                await task
+            else:
+                task.cancel()
+        self.preload_task = None
+
+        preloaded, self.preloaded = self.preloaded, None
+        if preloaded is not None:
+            preloaded_entry, player = preloaded
+            if isinstance(player, YTDLSource):
+                player.volume = self.volume
+            if preloaded_entry is entry and player.volume == self.volume:
+                return player
+            player.cleanup()
+
+        return await entry.create_player(self.bot.loop, self.volume)
+
+    def schedule_preload(self, entry):
+        duration = entry.player.data.get('duration')
+        if duration:
+            delay = max(0, duration - PRELOAD_AHEAD)
+            self.preload_task = self.bot.loop.create_task(self._preload_next(delay))
+
+    async def _preload_next(self, delay):
+        await asyncio.sleep(delay)
+        if self.repeat_enabled and self.repeated_entry:
+            upcoming = self.repeated_entry
+        else:
+            upcoming = next(iter(self.music_queue.peek(1)), None)
+        if upcoming is None:
+            return
 
-    async def bot_is_alone(self, ctx):
-        number_of_members = len(ctx.voice_client.channel.voice_states)
-        if number_of_members <= ONE_MEMBER:
-            while not self.music_queue.empty():
-                self.music_queue.get_nowait()
-            embed = discord.Embed(
-                title='Disconnecting to save my owner some bandwidth',
-                description='{} other(s) detected as connected to this channel'.format(number_of_members - 1),
-                colour=discord.Colour.blue(),
-            )
-            await ctx.send(embed=embed)
-            await ctx.voice_client.disconnect()
-            return True
-        return False
+        self.preloading = True
+        player = None
+        try:
+            player = await upcoming.create_player(self.bot.loop, self.volume)
+            await self.bot.loop.run_in_executor(None, player.buffer.fill, PRELOAD_FRAMES)
+            self.preloaded = (upcoming, player)
+            log.debug('Preloaded {} frames of {}'.format(len(player.buffer), upcoming.url))
+        except asyncio.CancelledError:
+            if player is not None:
+                player.cleanup()
+            raise
+        except Exception as e:
+            # Not fatal, the song gets started the normal way when its turn comes
+            log.debug('Failed to preload {}: {}'.format(upcoming.url, e))
+        finally:
+            self.preloading = False
+
+    def discard_preloaded(self):
+        if self.preload_task is not None:
+            self.preload_task.cancel()
+            self.preload_task = None
+        if self.preloaded is not None:
+            self.preloaded[1].cleanup()
+            self.preloaded = None
+
+    def record_gap(self):
+        if self.track_ended_at is None:
+            return
+        gap = time.perf_counter() - self.track_ended_at
+        self.track_ended_at = None
+        self.gaps.append(gap)
+        log.debug('Inter-track gap for guild {}: {:.0f}ms'.format(self.guild_id, gap * 1000))
 
     async def error_playing_embed(self, entry):
         embed = discord.Embed(
@@ -157,7 +736,7 @@ class Music(Cog):
             description=entry.url,
             colour=discord.Colour.blue(),
         )
-        await entry.ctx.send(embed=embed)
+        await self.bot.get_channel(entry.channel_id).send(embed=embed)
 
     def now_playing_embed(self, entry):
         title = '▶️ Now Playing 🎵'
@@ -181,7 +760,8 @@ class Music(Cog):
         embed.add_field(name=name, value=value, inline=True)
 
         name = 'Requester'
-        value = entry.ctx.message.author
+        requester = self.bot.get_guild(self.guild_id).get_member(entry.requester_id)
+        value = requester if requester is not None else '<@{}>'.format(entry.requester_id)
         embed.add_field(name=name, value=value, inline=True)
 
         name = 'Songs in Queue'
@@ -213,13 +793,142 @@ class Music(Cog):
         except KeyError:
             return 'No {} specified'.format(value)
 
-    def play_next_entry(self, error):
+    def on_track_end(self, error):
+        """Called by the voice client's player thread when the current song finishes or is stopped. """
+        self.track_ended_at = time.perf_counter()
         log.warning('Player error: %s' % error) if error else None
-        self.bot.loop.call_soon_threadsafe(self.next_song.set)
+        self.bot.loop.call_soon_threadsafe(self.track_finished.set)
 
-    @music_player.before_loop
-    async def before_music(self):
-        await self.bot.wait_until_ready()
+
+class Music(Cog):
+    """Commands for playing music in voice chat. """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.sessions = dict()
+        self.idle_timers = dict()
+        client_id = credentials['spotify_client_id']
+        client_secret = credentials['spotify_secret']
+        max_concurrency = credentials.get('spotify_max_concurrency', 4)
+        self.spotify = SpotifyClient(client_id, client_secret, max_concurrency=max_concurrency)
+        self.track_index = TrackIndex(max_entries=credentials.get('spotify_index_size', 20000))
+        self.save_music_data.start()
+
+    async def cog_unload(self):
+        for timer in self.idle_timers.values():
+            timer.cancel()
+        self.idle_timers.clear()
+        for session in self.sessions.values():
+            session.stop()
+        self.sessions.clear()
+        await self.spotify.close()
+        self.save_music_data.cancel()
+        if self.track_index.dirty:
+            self.track_index.dump_json()
+        if audio_cache.dirty:
+            audio_cache.dump_json()
+        extractor_pool.shutdown()
+
+    def get_session(self, guild):
+        """Returns the music session for the guild, creating and starting one if needed.
+
+        Only joining voice and playing call this, every other command uses an existing session.
+        """
+        session = self.sessions.get(guild.id)
+        if session is None:
+            session = MusicSession(self.bot, guild.id, self.track_index)
+            session.start()
+            self.sessions[guild.id] = session
+        return session
+
+    def destroy_session(self, guild_id):
+        session = self.sessions.pop(guild_id, None)
+        if session is not None:
+            log.debug('Tearing down music session for guild {}'.format(guild_id))
+            session.stop()
+
+    def stats_fields(self):
+        """Returns (name, value) pairs describing the music caches for the !stats embed. """
+        return [('Extractor Pool', extractor_pool.stats_string()),
+                ('Extraction Cache', extraction_cache.stats_string()),
+                ('Audio Cache', audio_cache.stats_string()),
+                ('Search Providers', search_resolver.stats_string()),
+                ('Spotify Track Index', self.track_index.stats_string()),
+                ('Inter-track Gap', self.gap_stats_string()),
+                ('Players', self.player_stats_string())]
+
+    def player_stats_string(self):
+        states = [session.state for session in self.sessions.values()]
+        resolve_times = [duration for session in self.sessions.values()
+                         for duration in session.time_in_state(RESOLVING)]
+        value = ', '.join('{} {}'.format(states.count(state), state)
+                          for state in (PLAYING, PAUSED, RESOLVING, IDLE) if state in states) or 'None active'
+        if resolve_times:
+            value += '\navg resolve {:.0f}ms, max {:.0f}ms'.format(
+                sum(resolve_times) / len(resolve_times) * 1000, max(resolve_times) * 1000)
+        return value
+
+    def gap_stats_string(self):
+        gaps = [gap for session in self.sessions.values() for gap in session.gaps]
+        if not gaps:
+            return 'No songs played back to back yet'
+        return 'avg {:.0f}ms, max {:.0f}ms over the last {} transitions'.format(
+            sum(gaps) / len(gaps) * 1000, max(gaps) * 1000, len(gaps))
+
+    @Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        guild = member.guild
+        if member.id == self.bot.user.id and after.channel is None:
+            # The bot's own voice client went away, so nothing is left to play for that guild
+            self.cancel_idle_timer(guild.id)
+            self.destroy_session(guild.id)
+            return
+
+        voice_client = guild.voice_client
+        if voice_client is None or voice_client.channel not in (before.channel, after.channel):
+            return
+
+        if any(not user.bot for user in voice_client.channel.members):
+            self.cancel_idle_timer(guild.id)
+        elif guild.id not in self.idle_timers:
+            self.idle_timers[guild.id] = self.bot.loop.create_task(self.disconnect_when_idle(guild))
+
+    def cancel_idle_timer(self, guild_id):
+        timer = self.idle_timers.pop(guild_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def disconnect_when_idle(self, guild):
+        """Disconnects from the guild's voice channel if nobody rejoins within IDLE_DISCONNECT_DELAY. """
+        try:
+            await asyncio.sleep(IDLE_DISCONNECT_DELAY)
+        except asyncio.CancelledError:
+            return
+
+        self.idle_timers.pop(guild.id, None)
+        voice_client = guild.voice_client
+        if voice_client is None:
+            return
+
+        session = self.sessions.get(guild.id)
+        if session is not None and session.text_channel is not None:
+            embed = discord.Embed(
+                title='Disconnecting to save my owner some bandwidth',
+                description='Nobody else has been in the channel for {} seconds'.format(IDLE_DISCONNECT_DELAY),
+                colour=discord.Colour.blue(),
+            )
+            await session.text_channel.send(embed=embed)
+        self.destroy_session(guild.id)
+        await voice_client.disconnect()
+
+    @tasks.loop(minutes=10)
+    async def save_music_data(self):
+        if self.track_index.dirty:
+            log.debug('Saving Spotify track index to storage')
+            self.track_index.dump_json()
+        if audio_cache.dirty:
+            log.debug('Saving audio cache index to storage')
+            audio_cache.dump_json()
 
     @commands.command()
     async def join(self, ctx):
@@ -238,21 +947,29 @@ class Music(Cog):
 
     async def _play(self, ctx, url, shuffle=False):
         async with ctx.typing():
-            if 'spotify' in url:
-                music_list = self.get_from_spotify(url)
-            else:
-                # Single item in music list
-                music_list = list()
-                music_list.append(url)
-
-            if shuffle:
-                random.shuffle(music_list)
+            session = self.get_session(ctx.guild)
+            session.text_channel = ctx.channel
+            # Time to first audio is only meaningful when nothing is ahead of this request
+            requested_at = time.perf_counter() if session.state == IDLE and session.music_queue.empty() else None
+            music_list_length = 0
+            try:
+                # Spotify pages are queued as they arrive so the first songs can start playing right away
+                async for music_list in self.get_music_batches(url, shuffle=shuffle):
+                    entries = [MusicEntry(url, ctx.author.id, ctx.channel.id, index_key=index_key)
+                               for url, index_key in music_list]
+                    if entries and requested_at is not None:
+                        entries[0].requested_at = requested_at
+                        requested_at = None
+                    session.music_queue.put_many(entries)
+                    session.lookup_entries(entries)
+                    music_list_length += len(music_list)
+                    session.prefetch_upcoming()
+            except SpotifyError as e:
+                log.warning('Failed to get songs from Spotify: {}'.format(e))
+                await ctx.send("Couldn't get the songs from that Spotify link!")
+                if not music_list_length:
+                    return
 
-            for url in music_list:
-                entry = MusicEntry(url, ctx.voice_client, ctx)
-                await self.music_queue.put(entry)
-
-            music_list_length = len(music_list)
             description = url if music_list_length == 1 else '{} songs'.format(music_list_length)
 
             embed = discord.Embed(
@@ -266,58 +983,105 @@ class Music(Cog):
     @commands.command()
     async def shuffle(self, ctx):
         """Shuffles the current music queue."""
-        if self.repeat_enabled:
+        session = self.sessions[ctx.guild.id]
+        if session.repeat_enabled:
             await ctx.send("Can't shuffle while repeat is enabled!")
             return
 
-        try:
-            random.shuffle(self.music_queue._queue)
-        except Exception as e:
-            log.warning("Failed to shuffle the music queue: {}".format(e))
-            await ctx.send("Error shuffling music queue!")
+        session.music_queue.shuffle()
+        session.prefetch_upcoming()
+        await ctx.message.add_reaction('👍')
+
+    @commands.command(name='queue')
+    async def show_queue(self, ctx, page: int = 1):
+        """Shows a page of the music queue. Use the IDs to remove or move songs."""
+        page = max(1, page)
+        session = self.sessions[ctx.guild.id]
+        entries, total_pages = session.music_queue.page(page, QUEUE_PAGE_SIZE)
+        description = '\n'.join('`{}` {}'.format(entry.entry_id, entry.display_name()) for entry in entries)
+
+        embed = discord.Embed(
+            title='Music Queue 🎶 {}/{}'.format(page, total_pages),
+            description=description or 'Nothing queued on this page',
+            colour=discord.Colour.blue()
+        )
+        queue_size = session.music_queue.qsize()
+        footer = '{} songs in queue'.format(queue_size)
+        if queue_size:
+            total_bytes = sum(entry.memory_size() for entry in session.music_queue)
+            footer += ', ~{} bytes per song'.format(total_bytes // queue_size)
+        embed.set_footer(text=footer)
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    async def remove(self, ctx, entry_id: int):
+        """Removes a song from the music queue by its ID in !queue."""
+        entry = self.sessions[ctx.guild.id].music_queue.remove(entry_id)
+        if entry is None:
+            await ctx.send("There's no song with ID {} in the queue!".format(entry_id))
             return
+        await ctx.send('Removed {} from the queue.'.format(entry.display_name()))
 
+    @commands.command()
+    async def playnext(self, ctx, entry_id: int):
+        """Moves a song to the front of the music queue by its ID in !queue."""
+        session = self.sessions[ctx.guild.id]
+        if not session.music_queue.move_to_front(entry_id):
+            await ctx.send("There's no song with ID {} in the queue!".format(entry_id))
+            return
+        session.prefetch_upcoming()
         await ctx.message.add_reaction('👍')
 
-    def get_from_spotify(self, url):
-        """Use Spotipy to get a list of songs from a spotify. """
-        try:
-            return_list = self._get_playlist_from_spotify(url)
-        except spotipy.SpotifyException:
-            return_list = self._get_playlist_from_album(url)
-
-        return return_list
-
-    def _get_playlist_from_spotify(self, url):
-        fields = 'items.track.name,items.track.artists'
-        music_list = self.spotipy.playlist_items(url, fields=fields, additional_types=['track'])
-        return_list = list()
-        for track in music_list['items']:
-            url_info = ''
-            url_info += '{} '.format(track['track']['name'])
-            for artist in track['track']['artists']:
-                url_info += '{} '.format(artist['name'])
-            url_info += 'song music'
-            return_list.append(url_info)
-        return return_list
-
-    def _get_playlist_from_album(self, url):
-        music_list = self.spotipy.album_tracks(url)
-        return_list = list()
-        for track in music_list['items']:
-            url_info = ''
-            url_info += '{} '.format(track['name'])
-            for artist in track['artists']:
-                url_info += '{} '.format(artist['name'])
-            url_info += 'song music'
-            return_list.append(url_info)
-        return return_list
+    @commands.command()
+    async def dedupe(self, ctx):
+        """Removes duplicate songs from the music queue."""
+        removed = self.sessions[ctx.guild.id].music_queue.dedupe(lambda entry: normalize_query(entry.url))
+        await ctx.send('Removed {} duplicate song(s) from the queue.'.format(removed))
+
+    async def get_music_batches(self, url, shuffle=False):
+        """Yields lists of (url or search query, spotify index key) pairs to queue for a play request. """
+        if 'spotify' not in url:
+            # Single item in music list
+            yield [(url, None)]
+            return
+
+        if shuffle:
+            # Shuffling needs every track up front
+            music_list = list()
+            async for tracks in self.spotify.iter_tracks(url):
+                music_list.extend(self._get_spotify_track(track) for track in tracks)
+            random.shuffle(music_list)
+            yield music_list
+            return
+
+        async for tracks in self.spotify.iter_tracks(url):
+            yield [self._get_spotify_track(track) for track in tracks]
+
+    def _get_spotify_track(self, track):
+        key = track_key(track)
+        url = self.track_index.get_url(key)
+        if url is not None:
+            # Already know which video this track is, no need to search for it
+            return url, None
+        return track_query(track), key
 
     @commands.command()
     async def volume(self, ctx, volume: int):
-        """Adjust the bot's voice volume (15 is the default)."""
-        original = int(ctx.voice_client.source.volume * 100)
-        ctx.voice_client.source.volume = volume / 100
+        """Adjust the bot's voice volume (15 is the default, 100 with Opus passthrough)."""
+        session = self.sessions[ctx.guild.id]
+        original = int(session.volume * 100)
+        session.volume = volume / 100
+
+        source = ctx.voice_client.source
+        was_paused = ctx.voice_client.is_paused()
+        if isinstance(source, YTDLOpusSource) and (ctx.voice_client.is_playing() or was_paused):
+            # ffmpeg applies the volume, so swap in a source restarted at the current position
+            ctx.voice_client.source = source.with_volume(session.volume)
+            source.cleanup()
+            if was_paused:
+                ctx.voice_client.pause()
+        elif source is not None:
+            source.volume = session.volume
 
         description = '{} -> {}'.format(str(original), str(volume))
         embed = discord.Embed(
@@ -331,7 +1095,7 @@ class Music(Cog):
     @commands.command()
     async def skip(self, ctx):
         """Skip the current song."""
-        if self.repeat_enabled:
+        if self.sessions[ctx.guild.id].repeat_enabled:
             await ctx.send("Can't skip while Repeat is enabled!")
             return
 
@@ -341,37 +1105,38 @@ class Music(Cog):
     @commands.command()
     async def stop(self, ctx):
         """Stops what's playing."""
-        while not self.music_queue.empty():
-            self.music_queue.get_nowait()
+        self.destroy_session(ctx.guild.id)
         await ctx.voice_client.disconnect()
 
     @commands.command()
     async def pause(self, ctx):
         """Pauses the current song."""
-        ctx.voice_client.pause()
+        self.sessions[ctx.guild.id].pause(ctx.voice_client)
 
     @commands.command()
     async def resume(self, ctx):
-        """Pauses the current song."""
-        ctx.voice_client.resume()
+        """Resumes the current song."""
+        self.sessions[ctx.guild.id].resume(ctx.voice_client)
 
     @commands.command()
     async def repeat(self, ctx):
         """Enable/Disable repeat the current playing song."""
-        self.repeat_enabled = not self.repeat_enabled
+        session = self.sessions[ctx.guild.id]
+        session.repeat_enabled = not session.repeat_enabled
         message = "Current/Next Song Repeat is now {}."
-        if self.repeat_enabled:
+        if session.repeat_enabled:
             await ctx.send(message.format("enabled"))
         else:
-            self.repeated_entry = None
+            session.repeated_entry = None
             await ctx.send(message.format("disabled"))
 
     @commands.command()
     async def loop(self, ctx):
         """Enable/Disable looping the current music queue."""
-        self.loop_enabled = not self.loop_enabled
+        session = self.sessions[ctx.guild.id]
+        session.loop_enabled = not session.loop_enabled
         message = "Music Looping is now {}."
-        if self.loop_enabled:
+        if session.loop_enabled:
             await ctx.send(message.format("enabled"))
         else:
             await ctx.send(message.format("disabled"))
@@ -383,25 +1148,42 @@ class Music(Cog):
         if ctx.voice_client is None:
             if ctx.author.voice:
                 await ctx.author.voice.channel.connect()
-                await self.reset_player_controls()
+                await self.get_session(ctx.guild).reset_player_controls()
             else:
                 await ctx.send("You are not connected to a voice channel.")
                 raise commands.CommandError("Author not connected to a voice channel.")
         elif ctx.author.voice:
             if ctx.author.voice.channel != ctx.voice_client.channel:
                 await ctx.voice_client.move_to(ctx.author.voice.channel)
-                await self.reset_player_controls()
+                await self.get_session(ctx.guild).reset_player_controls()
 
-    @resume.before_invoke
-    @pause.before_invoke
     @stop.before_invoke
-    @skip.before_invoke
-    @volume.before_invoke
     async def ensure_voice_connected(self, ctx):
         if ctx.voice_client is None:
             await ctx.send("Not connected to a voice channel.")
             raise commands.CommandError("Bot is not connected to a voice channel")
 
+    @resume.before_invoke
+    @pause.before_invoke
+    @skip.before_invoke
+    @volume.before_invoke
+    async def ensure_player(self, ctx):
+        await self.ensure_voice_connected(ctx)
+        await self.ensure_session(ctx)
+
+    @shuffle.before_invoke
+    @show_queue.before_invoke
+    @remove.before_invoke
+    @playnext.before_invoke
+    @dedupe.before_invoke
+    @repeat.before_invoke
+    @loop.before_invoke
+    async def ensure_session(self, ctx):
+        # Sessions only live alongside a voice connection, so only playing creates one
+        if ctx.guild.id not in self.sessions:
+            await ctx.send("Nothing is playing right now!")
+            raise commands.CommandError("No music session for this guild")
+
     @stop.after_invoke
     @skip.after_invoke
     @resume.after_invoke
@@ -412,6 +1194,49 @@ class Music(Cog):
     async def thumbs_up(self, ctx):
         await ctx.message.add_reaction('👍')
 
+    @commands.command(name='music-stats')
+    async def music_stats(self, ctx, output: str = None):
+        """Audio pipeline stats for this server's player. Add json for a machine-readable dump."""
+        session = self.sessions.get(ctx.guild.id)
+        if session is None:
+            await ctx.send("Nothing has been played in this server yet!")
+            return
+
+        dump = session.telemetry_dump()
+        if output == 'json':
+            # Only this server's session, other servers' queues aren't this server's business
+            data = io.BytesIO(json.dumps({'session': dump, 'extractor_pool': extractor_pool.to_dict()},
+                                         indent=2).encode('utf-8'))
+            await ctx.send(file=discord.File(data, filename='music-stats.json'))
+            return
+
+        embed = discord.Embed(
+            title='Music Pipeline Stats 📈',
+            description='Player is {}'.format(dump['state']),
+            colour=discord.Colour.blue()
+        )
+        if dump['current'] is not None:
+            embed.add_field(name='Now Playing', value=self._format_telemetry(dump['current']), inline=False)
+
+        history = dump['history']
+        if history:
+            name = 'Last {} Songs'.format(len(history))
+            value = 'underruns: {}\n'.format(sum(song['underruns'] for song in history))
+            for key in ('time_to_first_audio', 'extract_time', 'ffmpeg_startup_time', 'player_cpu_per_second'):
+                values = [song[key] for song in history if song[key] is not None]
+                if values:
+                    value += 'avg {}: {:.3f}\n'.format(key.replace('_', ' '), sum(values) / len(values))
+            embed.add_field(name=name, value=value, inline=False)
+
+        await ctx.send(embed=embed)
+
+    def _format_telemetry(self, telemetry):
+        lines = list()
+        for key, value in telemetry.items():
+            if value is not None:
+                lines.append('{}: {}'.format(key.replace('_', ' '), value))
+        return '\n'.join(lines)
+
     @commands.command()
     async def count(self, ctx):
         """Current VC member count (Mostly for debug)."""
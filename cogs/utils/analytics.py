@@ -0,0 +1,166 @@
+import asyncio
+import time
+
+import numpy as np
+from cogs.utils.timeslice import TimeSlicer
+from scipy import sparse
+
+
+# Seconds a stale matrix keeps being used before updates make it rebuild
+MATRIX_MAX_AGE = 60
+CORRELATED_GAMES = 5
+
+
+class GameMatrix:
+    """A sparse member x game matrix of seconds played, with the per-game orderings queries need.
+
+    Built from a copy of the store's rows, so it can be built off the event loop and then swapped in whole.
+    """
+    def __init__(self, member_ids, lengths, game_ids, seconds, game_count):
+        indptr = np.zeros(len(member_ids) + 1, np.int64)
+        np.cumsum(np.asarray(lengths, np.int64), out=indptr[1:])
+        # MemberRow arrays keep their game ids sorted, which is what CSR expects
+        indices = np.frombuffer(game_ids, np.uint32)
+        data = np.frombuffer(seconds, np.uint64).astype(np.float64)
+
+        self.member_index = dict(zip(member_ids, range(len(member_ids))))
+        self.matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(member_ids), game_count))
+
+        # Sort each game's column of playtimes so medians and ranks are index lookups
+        columns = self.matrix.tocsc()
+        self.column_starts = columns.indptr
+        self.players = np.diff(columns.indptr)
+        column_of_entry = np.repeat(np.arange(columns.shape[1]), self.players)
+        self.sorted_columns = columns.data[np.lexsort((columns.data, column_of_entry))]
+        self.medians = np.zeros(columns.shape[1])
+        has_players = self.players > 0
+        starts = columns.indptr[:-1][has_players]
+        counts = self.players[has_players]
+        self.medians[has_players] = (self.sorted_columns[starts + (counts - 1) // 2] +
+                                     self.sorted_columns[starts + counts // 2]) / 2
+
+        self.member_totals = np.asarray(self.matrix.sum(axis=1)).ravel()
+        self.sorted_totals = np.sort(self.member_totals)
+        self.played = columns.astype(bool).astype(np.float64)
+
+
+class GameAnalytics:
+    """Aggregate gametime queries answered from a sparse member x game matrix built from a GameStore.
+
+    The matrix is rebuilt once it has been invalidated by an update and is over max_age seconds old, so a burst
+    of commands shares one build and every query on it is vectorized. Only copying the store's rows happens on
+    the event loop, in time slices, the matrix itself is built on a thread.
+    """
+    def __init__(self, store, max_age=MATRIX_MAX_AGE):
+        self.store = store
+        self.max_age = max_age
+        self.version = 0
+        self.built_version = None
+        self.built_at = None
+        self.build_time = None
+        self.copy_time = None
+        self.builds = 0
+        self.current = None
+        self.lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+
+    def is_fresh(self):
+        if self.built_version == self.version:
+            return True
+        return self.built_at is not None and time.monotonic() - self.built_at < self.max_age
+
+    async def refresh(self):
+        """Rebuilds the matrix if it's out of date and old enough, await before any query. """
+        async with self.lock:
+            if self.is_fresh():
+                return
+
+            started = time.perf_counter()
+            version = self.version
+            member_ids = list(self.store.members)
+            lengths = list()
+            game_ids = list()
+            seconds = list()
+            slicer = TimeSlicer()
+            # Copied in time slices, credits landing in between just make the copy a little newer
+            async for member_id in slicer.iterate(member_ids):
+                row = self.store.members[member_id]
+                lengths.append(len(row))
+                game_ids.append(row.game_ids.tobytes())
+                seconds.append(row.seconds.tobytes())
+            game_count = len(self.store.game_names)
+            self.copy_time = slicer.busy
+
+            self.current = await asyncio.to_thread(GameMatrix, member_ids, lengths, b''.join(game_ids),
+                                                   b''.join(seconds), game_count)
+            self.built_version = version
+            self.built_at = time.monotonic()
+            self.build_time = time.perf_counter() - started
+            self.builds += 1
+
+    def game_summary(self, game_id):
+        """Returns (players, median seconds, mean seconds) for the game. """
+        matrix = self.current
+        if game_id >= len(matrix.players) or not matrix.players[game_id]:
+            return 0, 0, 0
+        start, end = matrix.column_starts[game_id], matrix.column_starts[game_id + 1]
+        mean = matrix.sorted_columns[start:end].mean()
+        return int(matrix.players[game_id]), int(matrix.medians[game_id]), int(mean)
+
+    def percentile_rank(self, member_id, game_id=None):
+        """Returns the percentage of players who have played less than the member, overall or of the game.
+
+        None if the member hasn't played (the game).
+        """
+        matrix = self.current
+        index = matrix.member_index.get(member_id)
+        if index is None:
+            return None
+        if game_id is None:
+            values = matrix.sorted_totals
+            seconds = matrix.member_totals[index]
+        else:
+            if game_id >= len(matrix.players):
+                return None
+            seconds = matrix.matrix[index, game_id]
+            if not seconds:
+                return None
+            values = matrix.sorted_columns[matrix.column_starts[game_id]:matrix.column_starts[game_id + 1]]
+        return 100 * np.searchsorted(values, seconds, 'left') / len(values)
+
+    def coplay_correlations(self, game_id, count=CORRELATED_GAMES):
+        """Returns the (game id, correlation) pairs of the games whose players most overlap with the game's.
+
+        This is the phi coefficient between whether members have played each game.
+        """
+        matrix = self.current
+        members = matrix.played.shape[0]
+        if game_id >= len(matrix.players) or not members:
+            return list()
+
+        frequencies = matrix.players / members
+        both = np.asarray((matrix.played.T @ matrix.played[:, game_id]).todense()).ravel() / members
+        variances = frequencies * (1 - frequencies)
+        denominator = np.sqrt(variances * variances[game_id])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlations = (both - frequencies * frequencies[game_id]) / denominator
+        correlations[game_id] = np.nan
+        correlations[~np.isfinite(correlations)] = -np.inf
+
+        count = min(count, len(correlations))
+        best = np.argpartition(correlations, -count)[-count:]
+        best = best[np.argsort(correlations[best])[::-1]]
+        return [(int(game), float(correlations[game])) for game in best if np.isfinite(correlations[game])]
+
+    def stats_string(self):
+        if self.current is None:
+            return 'Not built yet'
+        matrix = self.current.matrix
+        members, games = matrix.shape
+        size = sum(array.nbytes for array in (matrix.data, matrix.indices, matrix.indptr))
+        return ('{} members x {} games, {} totals, {:.1f} MB\nBuilt {} times, last build took {:.0f}ms '
+                '({:.0f}ms on the event loop){}').format(
+            members, games, matrix.nnz, size / 1024 / 1024, self.builds, self.build_time * 1000,
+            self.copy_time * 1000, ', stale' if self.built_version != self.version else '')
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from cogs.utils.constants import AUDIO_CACHE_DIR, AUDIO_CACHE_JSON
+from cogs.utils.utils import dump_json, load_json
+
+
+log = logging.getLogger(__name__)
+
+BYTES_IN_MEGABYTE = 1024 * 1024
+# Prefer the native Opus/WebM stream so the file is stored without re-encoding
+DOWNLOAD_FORMAT = 'bestaudio[acodec=opus]/bestaudio/best'
+# Metadata kept alongside a cached file so it can be played without extracting it again
+METADATA_KEYS = ('id', 'title', 'artist', 'album', 'duration', 'thumbnail', 'webpage_url', 'extractor_key',
+                 'acodec')
+# Number of urls we remember play counts for
+MAX_PLAY_COUNTS = 10000
+FILES = 'files'
+PLAYS = 'plays'
+
+
+def _hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BYTES_IN_MEGABYTE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class AudioCache:
+    """On disk cache of songs that get played a lot, so replays don't stream them again.
+
+    A url is downloaded once it has been played min_plays times. Files are evicted least recently played first
+    once the cache grows past max_bytes, and are checked against their recorded size and sha256 before use.
+    """
+    def __init__(self, extractor_pool, outtmpl, enabled=False, min_plays=3, max_bytes=1024 * BYTES_IN_MEGABYTE):
+        self.extractor_pool = extractor_pool
+        self.enabled = enabled
+        self.min_plays = min_plays
+        self.max_bytes = max_bytes
+        self.download_options = {
+            'format': DOWNLOAD_FORMAT,
+            'outtmpl': os.path.join(AUDIO_CACHE_DIR, outtmpl),
+        }
+        self.files = None
+        self.plays = None
+        self.downloading = set()
+        # Files whose checksum has been verified since the bot started
+        self.verified = set()
+        self.dirty = False
+        self.hits = 0
+
+        if not os.path.isdir(AUDIO_CACHE_DIR):
+            os.makedirs(AUDIO_CACHE_DIR)
+        if not os.path.isfile(AUDIO_CACHE_JSON):
+            dump_json(AUDIO_CACHE_JSON, {FILES: {}, PLAYS: {}})
+        self.load_json()
+
+    def load_json(self):
+        data = load_json(AUDIO_CACHE_JSON)
+        self.files = OrderedDict(data.get(FILES, {}))
+        self.plays = OrderedDict(data.get(PLAYS, {}))
+
+    def dump_json(self):
+        dump_json(AUDIO_CACHE_JSON, {FILES: self.files, PLAYS: self.plays})
+        self.dirty = False
+
+    @property
+    def total_bytes(self):
+        return sum(record['size'] for record in self.files.values())
+
+    def contains(self, key):
+        return self.enabled and key in self.files
+
+    async def get(self, key):
+        """Returns the (path, metadata) of the cached file for the key, or None if it isn't usable. """
+        if not self.contains(key):
+            return None
+
+        record = self.files[key]
+        path = record['path']
+        try:
+            intact = os.path.getsize(path) == record['size']
+            if intact and path not in self.verified:
+                intact = await asyncio.to_thread(_hash_file, path) == record['sha256']
+        except OSError:
+            intact = False
+
+        if not intact:
+            log.warning('Cached audio for {} failed its integrity check, removing it'.format(key))
+            self._remove(key)
+            return None
+
+        self.verified.add(path)
+        self.files.move_to_end(key)
+        self.hits += 1
+        self.dirty = True
+        return path, record['metadata']
+
+    def record_play(self, key, loop):
+        """Counts a play of the key and starts downloading it once it's been played enough. """
+        if not self.enabled:
+            return
+
+        self.plays[key] = self.plays.get(key, 0) + 1
+        self.plays.move_to_end(key)
+        while len(self.plays) > MAX_PLAY_COUNTS:
+            self.plays.popitem(last=False)
+        self.dirty = True
+
+        if self.plays[key] >= self.min_plays and key not in self.files and key not in self.downloading:
+            self.downloading.add(key)
+            loop.create_task(self._download(key, loop))
+
+    async def _download(self, key, loop):
+        try:
+            info = await self.extractor_pool.extract_info(key, download=True, overrides=self.download_options,
+                                                          loop=loop)
+            if 'entries' in info:
+                info = info['entries'][0]
+            path = info['requested_downloads'][0]['filepath']
+            size = os.path.getsize(path)
+            sha256 = await asyncio.to_thread(_hash_file, path)
+        except Exception as e:
+            log.warning('Failed to cache audio for {}: {}'.format(key, e))
+            return
+        finally:
+            self.downloading.discard(key)
+
+        metadata = {name: info[name] for name in METADATA_KEYS if name in info}
+        self.files[key] = {'path': path, 'size': size, 'sha256': sha256, 'metadata': metadata}
+        self.verified.add(path)
+        self.dirty = True
+        log.debug('Cached audio for {} at {} ({} bytes)'.format(key, path, size))
+        self._evict()
+
+    def _evict(self):
+        total_bytes = self.total_bytes
+        while total_bytes > self.max_bytes and self.files:
+            key = next(iter(self.files))
+            total_bytes -= self.files[key]['size']
+            self._remove(key)
+
+    def _remove(self, key):
+        record = self.files.pop(key)
+        self.verified.discard(record['path'])
+        self.dirty = True
+        try:
+            os.remove(record['path'])
+        except OSError:
+            pass
+
+    def stats_string(self):
+        if not self.enabled:
+            return 'Disabled'
+        return '{} songs, {:.1f}/{:.0f} MB, {} hits, {} downloading'.format(
+            len(self.files), self.total_bytes / BYTES_IN_MEGABYTE, self.max_bytes / BYTES_IN_MEGABYTE, self.hits,
+            len(self.downloading))
@@ -0,0 +1,51 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """A least recently used cache where every entry carries its own expiry time.
+
+    Entries are evicted when they expire or when the cache grows past max_entries.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        try:
+            value, expires_at = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if time.time() >= expires_at:
+            del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats_string(self):
+        return '{:.0%} hit rate ({} hits, {} misses, {}/{} entries)'.format(
+            self.hit_rate, self.hits, self.misses, len(self), self.max_entries)
@@ -8,8 +8,14 @@ COOKS_AND_MOCHA = 'cooksandmocha.jpg'
 COOKS = 'cooks.jpg'
 GOOD_BOYS_AND_GIRLS = 'goodboysandgirls.jpg'
 GAMETIME_JSON = 'gametime.json'
+GAMETIME_STORE = 'gametime.bin'
+GAMETIME_DB = 'gametime.db'
+GAMETIME_EXPORT_DIR = 'gametime_exports'
 BIRTHDAY_JSON = 'birthday.json'
 POLL_JSON = 'poll.json'
+SPOTIFY_INDEX_JSON = 'spotify_index.json'
+AUDIO_CACHE_JSON = 'audio_cache.json'
+AUDIO_CACHE_DIR = 'audio_cache'
 MENACES_TO_SOBRIETY_SERVER_ID = 932057681307512922
 POOPER_SCOOPER_SUPPORT_SERVER_ID = 1045144253627637830
 SECONDS_IN_HOUR = 3600
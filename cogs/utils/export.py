@@ -0,0 +1,117 @@
+import argparse
+import csv
+import gzip
+import json
+import sqlite3
+
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+# Rows fetched and written at a time, the most the export ever holds in memory
+CHUNK_ROWS = 10000
+COLUMNS = ('member_id', 'game', 'seconds')
+# The gametime table is clustered on (member_id, game_id) so this streams in primary key order without sorting
+EXPORT_QUERY = """
+SELECT gametime.member_id, games.name, gametime.seconds FROM gametime JOIN games USING (game_id)
+"""
+
+
+def connect_read_only(database):
+    """Opens a read only connection, which WAL mode lets run alongside the bot's writes. """
+    return sqlite3.connect('file:{}?mode=ro'.format(database), uri=True)
+
+
+def iter_chunks(connection, chunk_rows=CHUNK_ROWS):
+    """Yields lists of up to chunk_rows (member id, game, seconds) rows. """
+    cursor = connection.execute(EXPORT_QUERY)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+
+def get_filename(name, fmt, compress):
+    # Parquet compresses inside the file
+    return '{}.{}{}'.format(name, fmt, '.gz' if compress and fmt != 'parquet' else '')
+
+
+def _open_text(path, compress):
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def _write_csv(chunks, path, compress):
+    rows = 0
+    with _open_text(path, compress) as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def _write_jsonl(chunks, path, compress):
+    rows = 0
+    with _open_text(path, compress) as f:
+        for chunk in chunks:
+            f.write(''.join(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n' for row in chunk))
+            rows += len(chunk)
+    return rows
+
+
+def _write_parquet(chunks, path, compress):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Parquet export needs pyarrow, install it with pip install pyarrow')
+
+    schema = pa.schema([('member_id', pa.uint64()), ('game', pa.string()), ('seconds', pa.uint64())])
+    rows = 0
+    # Every chunk becomes its own row group, so only one is ever in memory
+    with pq.ParquetWriter(path, schema, compression='zstd' if compress else 'none') as writer:
+        for chunk in chunks:
+            member_ids, games, seconds = zip(*chunk)
+            writer.write_table(pa.table([member_ids, games, seconds], schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+WRITERS = {'csv': _write_csv, 'jsonl': _write_jsonl, 'parquet': _write_parquet}
+
+
+def export(connection, path, fmt='csv', compress=False, chunk_rows=CHUNK_ROWS):
+    """Streams every gametime total to path in the format and returns the number of rows written. """
+    if fmt not in WRITERS:
+        raise ValueError('Unknown export format {}, use one of {}'.format(fmt, ', '.join(EXPORT_FORMATS)))
+    return WRITERS[fmt](iter_chunks(connection, chunk_rows), path, compress)
+
+
+def main():
+    from cogs.utils.constants import GAMETIME_DB
+
+    parser = argparse.ArgumentParser(description='Export gametime totals for offline analysis.')
+    parser.add_argument('output', nargs='?', help='file to write, defaults to gametime.<format>')
+    parser.add_argument('-f', '--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('-c', '--compress', action='store_true', help='gzip csv/jsonl, zstd for parquet')
+    parser.add_argument('-d', '--database', default=GAMETIME_DB)
+    args = parser.parse_args()
+
+    output = args.output or get_filename('gametime', args.format, args.compress)
+    connection = connect_read_only(args.database)
+    try:
+        rows = export(connection, output, args.format, args.compress)
+    except RuntimeError as e:
+        parser.error(str(e))
+    finally:
+        connection.close()
+    print('Exported {} rows to {}'.format(rows, output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+import yt_dlp as youtube_dl
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+log = logging.getLogger(__name__)
+
+# Each worker thread (or process) keeps its own YoutubeDL since the object isn't thread safe
+_worker_state = threading.local()
+
+
+# Only list search results (id, title, duration) without resolving their formats
+FLAT_OPTIONS = {'extract_flat': 'in_playlist'}
+
+
+def _get_worker_ytdl(options, overrides):
+    # One YoutubeDL per distinct set of option overrides
+    name = 'ytdl' + repr(sorted(overrides.items()))
+    ytdl = getattr(_worker_state, name, None)
+    if ytdl is None:
+        ytdl = youtube_dl.YoutubeDL(dict(options, **overrides))
+        setattr(_worker_state, name, ytdl)
+    return ytdl
+
+
+def _extract_info(options, url, download, overrides):
+    """Runs inside a worker. Returns the extracted info and how long the extraction itself took. """
+    started = time.time()
+    ytdl = _get_worker_ytdl(options, overrides)
+    info = ytdl.extract_info(url, download=download)
+    # Strip anything that can't cross a process boundary
+    info = ytdl.sanitize_info(info) if info is not None else None
+    return info, time.time() - started
+
+
+class ExtractorPool:
+    """A bounded pool of yt-dlp workers with queue depth and latency metrics.
+
+    At most `workers` extractions run at once, anything past that waits in the pool's queue.
+    With use_processes the extraction (and its parsing) runs in separate processes, off the bot's GIL.
+    """
+    def __init__(self, options, workers=4, use_processes=False):
+        self.options = options
+        self.workers = workers
+        self.use_processes = use_processes
+        if use_processes:
+            # Spawn rather than fork so the workers don't inherit the bot's event loop and sockets
+            context = multiprocessing.get_context('spawn')
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ytdl')
+
+        # Metrics
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def queue_depth(self):
+        """Number of extractions waiting for a free worker. """
+        return max(0, self.in_flight - self.workers)
+
+    async def extract_info(self, url, *, download=False, overrides=None, loop=None):
+        """Extracts the url on a worker, optionally with some of the pool's yt-dlp options overridden. """
+        loop = loop or asyncio.get_event_loop()
+        overrides = overrides or dict()
+        submitted = time.time()
+        self.in_flight += 1
+        try:
+            info, run_time = await loop.run_in_executor(self.executor, _extract_info, self.options, url, download,
+                                                        overrides)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+        latency = time.time() - submitted
+        self.completed += 1
+        self.total_run_time += run_time
+        self.total_wait_time += max(0.0, latency - run_time)
+        self.max_latency = max(self.max_latency, latency)
+        if self.queue_depth:
+            log.debug('{} extractions are waiting on the yt-dlp pool'.format(self.queue_depth))
+        return info
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def to_dict(self):
+        completed = self.completed or 1
+        return {
+            'workers': self.workers,
+            'use_processes': self.use_processes,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'completed': self.completed,
+            'failed': self.failed,
+            'avg_wait_time': round(self.total_wait_time / completed, 4),
+            'avg_extract_time': round(self.total_run_time / completed, 4),
+            'max_latency': round(self.max_latency, 4),
+        }
+
+    def stats_string(self):
+        completed = self.completed or 1
+        kind = 'processes' if self.use_processes else 'threads'
+        return ('{} {}, {} in flight, {} queued\n'
+                '{} done, {} failed, avg wait {:.2f}s, avg extract {:.2f}s, max {:.2f}s').format(
+            self.workers, kind, self.in_flight, self.queue_depth, self.completed, self.failed,
+            self.total_wait_time / completed, self.total_run_time / completed, self.max_latency)
@@ -0,0 +1,231 @@
+import time
+
+import numpy as np
+from cogs.utils.constants import SECONDS_IN_DAY
+
+
+# Bucket resolutions, bucket numbers are the days since the epoch the bucket starts on
+DAY = 0
+WEEK = 1
+MONTH = 2
+RESOLUTIONS = (DAY, WEEK, MONTH)
+# Daily buckets older than this are merged into weeks, and weeks older than WEEKLY_RETENTION_DAYS into months
+DAILY_RETENTION_DAYS = 90
+WEEKLY_RETENTION_DAYS = 365
+MEMBER_ID_TYPE = np.uint64
+GAME_ID_TYPE = np.uint32
+BUCKET_TYPE = np.int32
+SECONDS_TYPE = np.uint32
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS gametime_today (
+    day INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    PRIMARY KEY (member_id, game_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS gametime_history (
+    resolution INTEGER PRIMARY KEY,
+    member_ids BLOB NOT NULL,
+    game_ids BLOB NOT NULL,
+    buckets BLOB NOT NULL,
+    seconds BLOB NOT NULL
+);
+"""
+TODAY_UPSERT = """
+INSERT INTO gametime_today (day, member_id, game_id, seconds) VALUES (?, ?, ?, ?)
+ON CONFLICT (member_id, game_id) DO UPDATE SET day = excluded.day, seconds = excluded.seconds
+"""
+
+
+def get_day(timestamp=None):
+    """Returns the UTC day number, days since the epoch, of a timestamp or of now. """
+    return int((timestamp if timestamp is not None else time.time()) // SECONDS_IN_DAY)
+
+
+def week_start(days):
+    # The epoch was a Thursday, weeks start on Monday
+    return days - (days + 3) % 7
+
+
+def month_start(days):
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(BUCKET_TYPE)
+
+
+class BucketColumns:
+    """Gametime buckets in columnar form, one numpy array per field. """
+    __slots__ = ('member_ids', 'game_ids', 'buckets', 'seconds')
+
+    def __init__(self, member_ids=None, game_ids=None, buckets=None, seconds=None):
+        self.member_ids = member_ids if member_ids is not None else np.empty(0, MEMBER_ID_TYPE)
+        self.game_ids = game_ids if game_ids is not None else np.empty(0, GAME_ID_TYPE)
+        self.buckets = buckets if buckets is not None else np.empty(0, BUCKET_TYPE)
+        self.seconds = seconds if seconds is not None else np.empty(0, SECONDS_TYPE)
+
+    def __len__(self):
+        return len(self.seconds)
+
+    @property
+    def nbytes(self):
+        return self.member_ids.nbytes + self.game_ids.nbytes + self.buckets.nbytes + self.seconds.nbytes
+
+    @classmethod
+    def from_totals(cls, totals, bucket):
+        """Builds columns from {(member id, game id): seconds} totals that all fall in one bucket. """
+        count = len(totals)
+        return cls(np.fromiter((member_id for member_id, _ in totals), MEMBER_ID_TYPE, count),
+                   np.fromiter((game_id for _, game_id in totals), GAME_ID_TYPE, count),
+                   np.full(count, bucket, BUCKET_TYPE),
+                   np.fromiter(totals.values(), SECONDS_TYPE, count))
+
+    @classmethod
+    def from_blobs(cls, member_ids, game_ids, buckets, seconds):
+        return cls(np.frombuffer(member_ids, MEMBER_ID_TYPE), np.frombuffer(game_ids, GAME_ID_TYPE),
+                   np.frombuffer(buckets, BUCKET_TYPE), np.frombuffer(seconds, SECONDS_TYPE))
+
+    def to_blobs(self):
+        return self.member_ids.tobytes(), self.game_ids.tobytes(), self.buckets.tobytes(), self.seconds.tobytes()
+
+    def concat(self, other):
+        return BucketColumns(np.concatenate((self.member_ids, other.member_ids)),
+                             np.concatenate((self.game_ids, other.game_ids)),
+                             np.concatenate((self.buckets, other.buckets)),
+                             np.concatenate((self.seconds, other.seconds)))
+
+    def select(self, mask):
+        return BucketColumns(self.member_ids[mask], self.game_ids[mask], self.buckets[mask], self.seconds[mask])
+
+    def split(self, cutoff):
+        """Returns (buckets starting before cutoff, the rest). """
+        older = self.buckets < cutoff
+        return self.select(older), self.select(~older)
+
+    def rebucket(self, bucket_start):
+        """Moves every row to the bucket bucket_start maps it to and merges rows that end up sharing one. """
+        if not len(self):
+            return BucketColumns()
+
+        buckets = bucket_start(self.buckets)
+        order = np.lexsort((self.game_ids, self.member_ids, buckets))
+        member_ids, game_ids, buckets = self.member_ids[order], self.game_ids[order], buckets[order]
+        first = np.empty(len(order), bool)
+        first[0] = True
+        first[1:] = ((member_ids[1:] != member_ids[:-1]) | (game_ids[1:] != game_ids[:-1]) |
+                     (buckets[1:] != buckets[:-1]))
+        starts = np.flatnonzero(first)
+        return BucketColumns(member_ids[starts], game_ids[starts], buckets[starts],
+                             np.add.reduceat(self.seconds[order], starts).astype(SECONDS_TYPE))
+
+
+class GameHistory:
+    """Per member per game gametime in daily buckets, downsampled to weeks and then months as it ages.
+
+    The current day's totals are kept in a dict that's cheap to update and upsert row by row. When the day
+    ends they're sealed into the daily columns, which are then compacted under the retention policy, and the
+    columns are saved as one blob per field.
+    """
+    def __init__(self):
+        self.columns = {resolution: BucketColumns() for resolution in RESOLUTIONS}
+        self.today = get_day()
+        self.today_totals = dict()
+        self.dirty = set()
+        # Whether the columns changed since they were last saved
+        self.sealed = False
+
+    def load(self, connection):
+        connection.executescript(SCHEMA)
+        for resolution, *blobs in connection.execute('SELECT resolution, member_ids, game_ids, buckets, seconds '
+                                                     'FROM gametime_history'):
+            self.columns[resolution] = BucketColumns.from_blobs(*blobs)
+
+        for day, member_id, game_id, seconds in connection.execute('SELECT day, member_id, game_id, seconds '
+                                                                   'FROM gametime_today'):
+            self.today = day
+            self.today_totals[(member_id, game_id)] = seconds
+        self.roll(get_day())
+
+    def add(self, member_id, game_id, seconds, day=None):
+        self.roll(day if day is not None else get_day())
+        key = (member_id, game_id)
+        self.today_totals[key] = self.today_totals.get(key, 0) + seconds
+        self.dirty.add(key)
+
+    def roll(self, day):
+        """Seals the current day into the daily columns once the day is over. """
+        if day <= self.today:
+            return
+        if self.today_totals:
+            self.columns[DAY] = self.columns[DAY].concat(BucketColumns.from_totals(self.today_totals, self.today))
+            self.compact(day)
+            self.sealed = True
+        self.today = day
+        self.today_totals = dict()
+        self.dirty.clear()
+
+    def compact(self, day):
+        old_days, self.columns[DAY] = self.columns[DAY].split(day - DAILY_RETENTION_DAYS)
+        if len(old_days):
+            self.columns[WEEK] = self.columns[WEEK].concat(old_days).rebucket(week_start)
+
+        old_weeks, self.columns[WEEK] = self.columns[WEEK].split(day - WEEKLY_RETENTION_DAYS)
+        if len(old_weeks):
+            self.columns[MONTH] = self.columns[MONTH].concat(old_weeks).rebucket(month_start)
+
+    def snapshot(self):
+        """Takes what changed since the last save and marks it saved.
+
+        Sealing replaces the column arrays rather than changing them, so the snapshot can hold on to them while
+        they're written from another thread.
+        """
+        columns = dict(self.columns) if self.sealed else None
+        today_rows = [(self.today, member_id, game_id, self.today_totals[(member_id, game_id)])
+                      for member_id, game_id in self.dirty]
+        self.sealed = False
+        self.dirty.clear()
+        return columns, today_rows
+
+    def restore(self, snapshot):
+        """Marks a snapshot that failed to save as unsaved again. """
+        columns, today_rows = snapshot
+        if columns is not None:
+            self.sealed = True
+        self.dirty.update((member_id, game_id) for day, member_id, game_id, _ in today_rows if day == self.today)
+
+    @staticmethod
+    def write(connection, snapshot):
+        """Writes a snapshot, call inside the caller's transaction. """
+        columns, today_rows = snapshot
+        if columns is not None:
+            connection.execute('DELETE FROM gametime_today')
+            connection.executemany('INSERT OR REPLACE INTO gametime_history '
+                                   '(resolution, member_ids, game_ids, buckets, seconds) VALUES (?, ?, ?, ?, ?)',
+                                   [(resolution, *bucket_columns.to_blobs())
+                                    for resolution, bucket_columns in columns.items()])
+        connection.executemany(TODAY_UPSERT, today_rows)
+
+    def member_totals(self, member_id, since_day):
+        """Returns the member's (game id, seconds) pairs played since the day, from most to least played.
+
+        Weekly and monthly buckets count when they start on or after since_day, so windows reaching past the
+        daily retention period are rounded to the buckets they overlap.
+        """
+        game_ids = list()
+        seconds = list()
+        for columns in self.columns.values():
+            mask = (columns.member_ids == member_id) & (columns.buckets >= since_day)
+            game_ids.append(columns.game_ids[mask])
+            seconds.append(columns.seconds[mask])
+
+        if self.today >= since_day:
+            today = [(game_id, total) for (member, game_id), total in self.today_totals.items() if member == member_id]
+            game_ids.append(np.fromiter((game_id for game_id, _ in today), GAME_ID_TYPE, len(today)))
+            seconds.append(np.fromiter((total for _, total in today), SECONDS_TYPE, len(today)))
+
+        game_ids = np.concatenate(game_ids)
+        if not len(game_ids):
+            return list()
+        totals = np.bincount(game_ids, weights=np.concatenate(seconds)).astype(np.int64)
+        played = np.flatnonzero(totals)
+        played = played[np.argsort(totals[played])[::-1]]
+        return [(int(game_id), int(totals[game_id])) for game_id in played]
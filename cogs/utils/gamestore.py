@@ -0,0 +1,200 @@
+import heapq
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+
+MAGIC = b'PSGT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHII')
+NAME_LENGTH = struct.Struct('<H')
+MEMBER_HEADER = struct.Struct('<QI')
+# Typecodes: game ids fit in 32 bits, seconds played get 64
+GAME_ID_TYPE = 'I'
+SECONDS_TYPE = 'Q'
+
+
+class MemberRow:
+    """One member's totals, game ids kept sorted so lookups can bisect. """
+    __slots__ = ('game_ids', 'seconds')
+
+    def __init__(self):
+        self.game_ids = array(GAME_ID_TYPE)
+        self.seconds = array(SECONDS_TYPE)
+
+    def __len__(self):
+        return len(self.game_ids)
+
+    def find(self, game_id):
+        index = bisect_left(self.game_ids, game_id)
+        if index < len(self.game_ids) and self.game_ids[index] == game_id:
+            return index
+        return -1
+
+    def add(self, game_id, seconds):
+        index = bisect_left(self.game_ids, game_id)
+        if index < len(self.game_ids) and self.game_ids[index] == game_id:
+            self.seconds[index] += seconds
+        else:
+            self.game_ids.insert(index, game_id)
+            self.seconds.insert(index, seconds)
+        return self.seconds[index]
+
+
+class GameStore:
+    """Compact gametime totals: game names interned to integer ids, each member's totals in typed arrays.
+
+    Game names are stored once no matter how many members play them and each member row costs a few bytes
+    per game instead of a dict entry, string key and int object.
+    """
+    def __init__(self):
+        self.game_names = list()
+        self.game_ids = dict()
+        self.members = dict()
+
+    def __len__(self):
+        return len(self.members)
+
+    def intern(self, game):
+        """Returns the integer id for a game name, assigning a new one if it's never been seen. """
+        game_id = self.game_ids.get(game)
+        if game_id is None:
+            game_id = len(self.game_names)
+            self.game_names.append(game)
+            self.game_ids[game] = game_id
+        return game_id
+
+    def add_time(self, member_id, game, seconds):
+        """Adds seconds to the member's total for the game and returns the new total. """
+        return self.add_time_by_id(member_id, self.intern(game), seconds)
+
+    def add_time_by_id(self, member_id, game_id, seconds):
+        row = self.members.get(member_id)
+        if row is None:
+            row = self.members[member_id] = MemberRow()
+        return row.add(game_id, seconds)
+
+    def get_time(self, member_id, game):
+        game_id = self.game_ids.get(game)
+        return self.get_time_by_id(member_id, game_id) if game_id is not None else 0
+
+    def get_time_by_id(self, member_id, game_id):
+        row = self.members.get(member_id)
+        if row is None:
+            return 0
+        index = row.find(game_id)
+        return row.seconds[index] if index >= 0 else 0
+
+    def get_member_games(self, member_id):
+        """Returns {game name: seconds} for the member, or None if they have no data. """
+        row = self.members.get(member_id)
+        if row is None:
+            return None
+        return {self.game_names[game_id]: seconds for game_id, seconds in zip(row.game_ids, row.seconds)}
+
+    def top_games(self, member_id, k=None):
+        """Returns the member's (game name, seconds) pairs from most to least played, at most k of them. """
+        row = self.members.get(member_id)
+        if row is None:
+            return list()
+        pairs = zip(row.seconds, row.game_ids)
+        ranked = heapq.nlargest(k, pairs) if k is not None else sorted(pairs, reverse=True)
+        return [(self.game_names[game_id], seconds) for seconds, game_id in ranked]
+
+    def rows(self):
+        """Yields (member id, game name, seconds) for every total in the store. """
+        for member_id, row in self.members.items():
+            for game_id, seconds in zip(row.game_ids, row.seconds):
+                yield member_id, self.game_names[game_id], seconds
+
+    @classmethod
+    def from_dict(cls, game_data):
+        """Builds a store from the JSON layout of {member id string: {game name: seconds}}. """
+        store = cls()
+        for member_id, games in game_data.items():
+            for game, seconds in games.items():
+                store.add_time(int(member_id), game, int(seconds))
+        return store
+
+    def to_dict(self):
+        return {str(member_id): self.get_member_games(member_id) for member_id in self.members}
+
+    def to_bytes(self):
+        parts = [HEADER.pack(MAGIC, FORMAT_VERSION, len(self.game_names), len(self.members))]
+        for name in self.game_names:
+            encoded = name.encode('utf-8')
+            parts.append(NAME_LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+        for member_id, row in self.members.items():
+            parts.append(MEMBER_HEADER.pack(member_id, len(row)))
+            parts.append(row.game_ids.tobytes())
+            parts.append(row.seconds.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, game_count, member_count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Not a version {} gametime store'.format(FORMAT_VERSION))
+        offset = HEADER.size
+
+        store = cls()
+        for _ in range(game_count):
+            (length,) = NAME_LENGTH.unpack_from(data, offset)
+            offset += NAME_LENGTH.size
+            store.intern(data[offset:offset + length].decode('utf-8'))
+            offset += length
+
+        for _ in range(member_count):
+            member_id, length = MEMBER_HEADER.unpack_from(data, offset)
+            offset += MEMBER_HEADER.size
+            row = MemberRow()
+            end = offset + length * row.game_ids.itemsize
+            row.game_ids.frombytes(data[offset:end])
+            offset = end
+            end = offset + length * row.seconds.itemsize
+            row.seconds.frombytes(data[offset:end])
+            offset = end
+            store.members[member_id] = row
+        return store
+
+    def memory_usage(self):
+        """Approximate bytes used by the store's containers and contents. """
+        size = sys.getsizeof(self.game_names) + sys.getsizeof(self.game_ids) + sys.getsizeof(self.members)
+        size += sum(sys.getsizeof(name) for name in self.game_names)
+        for member_id, row in self.members.items():
+            size += sys.getsizeof(member_id) + sys.getsizeof(row)
+            size += sys.getsizeof(row.game_ids) + sys.getsizeof(row.seconds)
+        return size
+
+
+def dict_memory_usage(game_data):
+    """Approximate bytes used by gametime data in the JSON dict layout, for comparison with a GameStore. """
+    size = sys.getsizeof(game_data)
+    for member_id, games in game_data.items():
+        size += sys.getsizeof(member_id) + sys.getsizeof(games)
+        for game, seconds in games.items():
+            size += sys.getsizeof(game) + sys.getsizeof(seconds)
+    return size
+
+
+if __name__ == '__main__':
+    import random
+
+    # Compare the dict layout with the store on a large synthetic dataset
+    random.seed(0)
+    games = ['Game {}'.format(i) for i in range(5000)]
+    game_data = dict()
+    for member in range(50000):
+        member_games = random.sample(games, random.randint(1, 40))
+        # Names loaded from JSON aren't shared between members, so copy them like json.load would
+        game_data[str(10 ** 17 + member)] = {''.join(game): random.randint(60, 10 ** 6) for game in member_games}
+
+    store = GameStore.from_dict(game_data)
+    dict_size = dict_memory_usage(game_data)
+    store_size = store.memory_usage()
+    print('members: {}, totals: {}'.format(len(game_data), sum(len(g) for g in game_data.values())))
+    print('dict:  {:.1f} MB'.format(dict_size / 1024 / 1024))
+    print('store: {:.1f} MB ({:.1f}x smaller)'.format(store_size / 1024 / 1024, dict_size / store_size))
+    print('binary file: {:.1f} MB'.format(len(store.to_bytes()) / 1024 / 1024))
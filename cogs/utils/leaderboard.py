@@ -0,0 +1,128 @@
+from collections import defaultdict
+
+
+# Number of entries each leaderboard keeps
+LEADERBOARD_SIZE = 10
+
+
+class TopK:
+    """The k highest scoring keys, for scores that only ever go up.
+
+    Since scores never drop, a key outside the top k can only get in by beating the lowest score in it, so
+    an update is O(1) unless it changes the lowest entry, which costs an O(k) scan for the new one.
+    """
+    __slots__ = ('k', 'scores', 'floor_key')
+
+    def __init__(self, k=LEADERBOARD_SIZE):
+        self.k = k
+        self.scores = dict()
+        self.floor_key = None
+
+    def __len__(self):
+        return len(self.scores)
+
+    def update(self, key, score):
+        scores = self.scores
+        if key in scores:
+            scores[key] = score
+            if key == self.floor_key:
+                self.floor_key = min(scores, key=scores.get)
+        elif len(scores) < self.k:
+            scores[key] = score
+            if self.floor_key is None or score < scores[self.floor_key]:
+                self.floor_key = key
+        elif score > scores[self.floor_key]:
+            del scores[self.floor_key]
+            scores[key] = score
+            self.floor_key = min(scores, key=scores.get)
+
+    def top(self):
+        """Returns the (key, score) pairs from highest to lowest score. """
+        return sorted(self.scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class Leaderboards:
+    """Top members per game, top members overall and top games, kept up to date as time is credited. """
+    def __init__(self, k=LEADERBOARD_SIZE):
+        self.k = k
+        self.games = dict()
+        self.members = TopK(k)
+        self.top_games = TopK(k)
+        self.member_totals = defaultdict(int)
+        self.game_totals = defaultdict(int)
+
+    def add(self, member_id, game_id, seconds, member_game_total):
+        """Records seconds credited to the member for the game, whose total for it is now member_game_total. """
+        game = self.games.get(game_id)
+        if game is None:
+            game = self.games[game_id] = TopK(self.k)
+        game.update(member_id, member_game_total)
+
+        self.member_totals[member_id] += seconds
+        self.members.update(member_id, self.member_totals[member_id])
+        self.game_totals[game_id] += seconds
+        self.top_games.update(game_id, self.game_totals[game_id])
+
+    @classmethod
+    def from_store(cls, store, k=LEADERBOARD_SIZE):
+        leaderboards = cls(k)
+        for member_id, row in store.members.items():
+            for game_id, seconds in zip(row.game_ids, row.seconds):
+                leaderboards.add(member_id, game_id, seconds, seconds)
+        return leaderboards
+
+    def game_leaderboard(self, game_id):
+        """Returns the top (member id, seconds) pairs for the game. """
+        game = self.games.get(game_id)
+        return game.top() if game is not None else list()
+
+    def member_leaderboard(self):
+        """Returns the top (member id, seconds) pairs across every game. """
+        return self.members.top()
+
+    def game_ranking(self):
+        """Returns the top (game id, seconds) pairs across every member. """
+        return self.top_games.top()
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    from cogs.utils.gamestore import GameStore
+
+    # Benchmark building, updating and reading the leaderboards against sorting the store on every read
+    random.seed(0)
+    member_count, game_count = 100000, 10000
+    store = GameStore()
+    for game in range(game_count):
+        store.intern('Game {}'.format(game))
+    for member in range(member_count):
+        for game_id in random.sample(range(game_count), random.randint(1, 20)):
+            store.add_time_by_id(member, game_id, random.randint(60, 10 ** 6))
+    print('members: {}, games: {}'.format(member_count, game_count))
+
+    started = time.perf_counter()
+    leaderboards = Leaderboards.from_store(store)
+    print('build: {:.2f}s'.format(time.perf_counter() - started))
+
+    updates = [(random.randrange(member_count), random.randrange(game_count), 60) for _ in range(100000)]
+    started = time.perf_counter()
+    for member_id, game_id, seconds in updates:
+        leaderboards.add(member_id, game_id, seconds, store.add_time_by_id(member_id, game_id, seconds))
+    elapsed = time.perf_counter() - started
+    print('update: {:.2f}us per credit (including the store)'.format(elapsed / len(updates) * 10 ** 6))
+
+    reads = 1000
+    started = time.perf_counter()
+    for _ in range(reads):
+        leaderboards.game_leaderboard(random.randrange(game_count))
+        leaderboards.member_leaderboard()
+        leaderboards.game_ranking()
+    print('top-k read: {:.1f}us per read'.format((time.perf_counter() - started) / reads / 3 * 10 ** 6))
+
+    started = time.perf_counter()
+    totals = defaultdict(int)
+    for member_id, row in store.members.items():
+        totals[member_id] = sum(row.seconds)
+    sorted(totals.items(), key=lambda item: item[1], reverse=True)[:LEADERBOARD_SIZE]
+    print('sorting the store: {:.1f}ms per read'.format((time.perf_counter() - started) * 1000))
@@ -0,0 +1,103 @@
+import asyncio
+import itertools
+import random
+from collections import OrderedDict
+
+
+class MusicQueue:
+    """Async playback queue where every entry gets a stable ID.
+
+    Entries live in an insertion ordered dict keyed by their ID, so appending, popping the next entry,
+    removing an entry and moving an entry to the front are all O(1).
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._ids = itertools.count(1)
+        self._not_empty = asyncio.Event()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def qsize(self):
+        return len(self._entries)
+
+    def empty(self):
+        return not self._entries
+
+    def put_nowait(self, entry):
+        """Adds the entry to the back of the queue and returns the ID it was given. """
+        entry.entry_id = next(self._ids)
+        self._entries[entry.entry_id] = entry
+        self._not_empty.set()
+        return entry.entry_id
+
+    async def put(self, entry):
+        return self.put_nowait(entry)
+
+    def put_many(self, entries):
+        """Adds all the entries to the back of the queue in one go. """
+        for entry in entries:
+            entry.entry_id = next(self._ids)
+            self._entries[entry.entry_id] = entry
+        if self._entries:
+            self._not_empty.set()
+
+    def get_nowait(self):
+        try:
+            _, entry = self._entries.popitem(last=False)
+        except KeyError:
+            raise asyncio.QueueEmpty
+        return entry
+
+    async def get(self):
+        """Removes and returns the next entry, waiting for one to be queued if it's empty. """
+        while not self._entries:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def remove(self, entry_id):
+        """Removes and returns the entry with the ID, or None if it isn't queued. """
+        return self._entries.pop(entry_id, None)
+
+    def move_to_front(self, entry_id):
+        """Makes the entry with the ID the next one played. Returns False if it isn't queued. """
+        if entry_id not in self._entries:
+            return False
+        self._entries.move_to_end(entry_id, last=False)
+        return True
+
+    def peek(self, count):
+        """Returns up to the next count entries without removing them. """
+        return list(itertools.islice(self._entries.values(), count))
+
+    def page(self, page, page_size):
+        """Returns the entries on a page (starting at 1, lower pages show the first) and the total number of pages. """
+        page = max(1, page)
+        total_pages = max(1, -(-len(self._entries) // page_size))
+        start = (page - 1) * page_size
+        return list(itertools.islice(self._entries.values(), start, start + page_size)), total_pages
+
+    def shuffle(self):
+        entries = list(self._entries.items())
+        random.shuffle(entries)
+        self._entries = OrderedDict(entries)
+
+    def dedupe(self, key):
+        """Removes entries whose key(entry) matches an earlier entry's. Returns the number removed. """
+        seen = set()
+        duplicates = list()
+        for entry_id, entry in self._entries.items():
+            entry_key = key(entry)
+            if entry_key in seen:
+                duplicates.append(entry_id)
+            seen.add(entry_key)
+        for entry_id in duplicates:
+            del self._entries[entry_id]
+        return len(duplicates)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+# Number of latencies each provider keeps for tuning the hedge delay
+LATENCY_HISTORY = 100
+# Samples needed before the hedge delay is taken from the primary provider's latencies
+MIN_SAMPLES = 10
+HEDGE_PERCENTILE = 0.9
+
+
+class ResolveError(Exception):
+    pass
+
+
+class ProviderStats:
+    """Latency and outcome counters for a single search provider. """
+    def __init__(self):
+        self.wins = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+
+    def percentile(self, percentile):
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+
+class HedgedResolver:
+    """Resolves a query with the first provider, racing the next one if it's slow or fails.
+
+    Providers are (name, fetch) pairs in order of preference, where fetch is an async callable taking the
+    query and returning a result or None. The next provider is started when the current ones have taken longer
+    than the hedge delay or have all failed, and the first good result wins. Once the primary provider has
+    enough samples, the hedge delay is its 90th percentile latency.
+    """
+    def __init__(self, providers, hedge_delay=2.0, adaptive=True):
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self.adaptive = adaptive
+        self.stats = {name: ProviderStats() for name, _ in providers}
+        self.hedges = 0
+
+    def get_hedge_delay(self):
+        primary = self.stats[self.providers[0][0]]
+        if self.adaptive and len(primary.latencies) >= MIN_SAMPLES:
+            return primary.percentile(HEDGE_PERCENTILE)
+        return self.hedge_delay
+
+    async def _fetch(self, name, fetch, query):
+        started = time.perf_counter()
+        try:
+            result = await fetch(query)
+        except asyncio.CancelledError:
+            # Lost the race, still worth knowing it took at least this long
+            self.stats[name].latencies.append(time.perf_counter() - started)
+            raise
+        except Exception as e:
+            log.debug('Provider {} failed for {}: {}'.format(name, query, e))
+            result = None
+        self.stats[name].latencies.append(time.perf_counter() - started)
+        if result is None:
+            self.stats[name].failures += 1
+        return name, result
+
+    async def resolve(self, query):
+        providers = iter(self.providers)
+        pending = set()
+        hedge_delay = self.get_hedge_delay()
+
+        def start_next():
+            try:
+                name, fetch = next(providers)
+            except StopIteration:
+                return False
+            pending.add(asyncio.ensure_future(self._fetch(name, fetch, query)))
+            return True
+
+        start_next()
+        try:
+            while pending:
+                done, pending_now = await asyncio.wait(pending, timeout=hedge_delay,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                pending.intersection_update(pending_now)
+                for task in done:
+                    name, result = task.result()
+                    if result is not None:
+                        self.stats[name].wins += 1
+                        return result
+
+                # Either everything running failed or it's been slow, so race the next provider
+                if start_next() and not done:
+                    self.hedges += 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise ResolveError('No provider could resolve {}'.format(query))
+
+    def stats_string(self):
+        lines = list()
+        for name, _ in self.providers:
+            stats = self.stats[name]
+            median = stats.percentile(0.5)
+            median = '{:.0f}ms'.format(median * 1000) if median is not None else 'n/a'
+            lines.append('{}: {} wins, {} failures, p50 {}'.format(name, stats.wins, stats.failures, median))
+        lines.append('{} hedged requests, hedge delay {:.2f}s'.format(self.hedges, self.get_hedge_delay()))
+        return '\n'.join(lines)
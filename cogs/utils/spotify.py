@@ -0,0 +1,217 @@
+import asyncio
+import aiohttp
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from cogs.utils.constants import SPOTIFY_INDEX_JSON
+from cogs.utils.utils import create_json, dump_json, load_json
+
+
+log = logging.getLogger(__name__)
+
+API_URL = 'https://api.spotify.com/v1'
+TOKEN_URL = 'https://accounts.spotify.com/api/token'
+PLAYLIST = 'playlist'
+ALBUM = 'album'
+# Largest page size each endpoint accepts
+PAGE_LIMITS = {PLAYLIST: 100, ALBUM: 50}
+PLAYLIST_FIELDS = 'total,items(track(id,name,artists(name)))'
+# Refresh the access token this many seconds before Spotify says it expires
+TOKEN_EXPIRY_MARGIN = 30
+MAX_RETRIES = 3
+# Seconds to wait before retrying a request that failed to connect or timed out
+RETRY_DELAY = 1
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=15, sock_connect=5)
+SPOTIFY_URL_REGEX = re.compile(r'(playlist|album)[/:]([A-Za-z0-9]+)')
+YOUTUBE_VIDEO_URL = 'https://www.youtube.com/watch?v={}'
+
+
+class SpotifyError(Exception):
+    pass
+
+
+def parse_spotify_url(url):
+    """Returns the (kind, id) of a Spotify playlist/album url or uri. """
+    match = SPOTIFY_URL_REGEX.search(url)
+    if match is None:
+        raise SpotifyError('Not a Spotify playlist or album: {}'.format(url))
+    return match.group(1), match.group(2)
+
+
+class SpotifyClient:
+    """Async Spotify Web API client that pages through playlists and albums concurrently.
+
+    The api_url and token_url can be pointed at a local fake Spotify API for testing.
+    """
+    def __init__(self, client_id, client_secret, *, max_concurrency=4, api_url=API_URL, token_url=TOKEN_URL):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.max_concurrency = max_concurrency
+        self.api_url = api_url
+        self.token_url = token_url
+        self._session = None
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = asyncio.Lock()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        # Created lazily since aiohttp sessions have to be made inside a running loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=REQUEST_TIMEOUT)
+        return self._session
+
+    async def _get_token(self):
+        async with self._token_lock:
+            if self._token is None or time.time() >= self._token_expires_at:
+                auth = aiohttp.BasicAuth(self.client_id, self.client_secret)
+                data = {'grant_type': 'client_credentials'}
+                async with self._get_session().post(self.token_url, data=data, auth=auth) as response:
+                    if response.status != 200:
+                        raise SpotifyError('Failed to get a Spotify token: HTTP {}'.format(response.status))
+                    body = await response.json()
+                self._token = body['access_token']
+                self._token_expires_at = time.time() + body.get('expires_in', 3600) - TOKEN_EXPIRY_MARGIN
+            return self._token
+
+    async def _get(self, path, params):
+        for _ in range(MAX_RETRIES):
+            try:
+                headers = {'Authorization': 'Bearer {}'.format(await self._get_token())}
+                async with self._get_session().get(self.api_url + path, params=params, headers=headers) as response:
+                    if response.status == 429:
+                        retry_after = int(response.headers.get('Retry-After', 1))
+                        log.debug('Spotify rate limited us, retrying in {} seconds'.format(retry_after))
+                        await asyncio.sleep(retry_after)
+                        continue
+                    if response.status == 401:
+                        # Token was revoked early, force a refresh on the next attempt
+                        self._token = None
+                        continue
+                    if response.status != 200:
+                        raise SpotifyError('Spotify returned HTTP {} for {}'.format(response.status, path))
+                    return await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.debug('Request for {} failed, retrying: {!r}'.format(path, e))
+                await asyncio.sleep(RETRY_DELAY)
+
+        raise SpotifyError('Gave up on {} after {} attempts'.format(path, MAX_RETRIES))
+
+    async def _get_page(self, kind, spotify_id, offset, semaphore):
+        limit = PAGE_LIMITS[kind]
+        params = {'limit': limit, 'offset': offset}
+        if kind == PLAYLIST:
+            params['fields'] = PLAYLIST_FIELDS
+            params['additional_types'] = 'track'
+
+        async with semaphore:
+            page = await self._get('/{}s/{}/tracks'.format(kind, spotify_id), params)
+
+        tracks = list()
+        for item in page['items']:
+            # Playlist items wrap the track, album items are the track
+            track = item.get('track') if kind == PLAYLIST else item
+            # Local files and removed tracks come back empty
+            if track:
+                tracks.append(track)
+        return page.get('total', len(tracks)), tracks
+
+    async def iter_tracks(self, url):
+        """Yields lists of track objects from a playlist or album as each page arrives.
+
+        The first page is fetched on its own to learn the total, then the remaining pages are fetched
+        concurrently (at most max_concurrency at a time), so pages after the first may arrive out of order.
+        """
+        kind, spotify_id = parse_spotify_url(url)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        total, tracks = await self._get_page(kind, spotify_id, 0, semaphore)
+        yield tracks
+
+        limit = PAGE_LIMITS[kind]
+        pending = [asyncio.ensure_future(self._get_page(kind, spotify_id, offset, semaphore))
+                   for offset in range(limit, total, limit)]
+        try:
+            for next_page in asyncio.as_completed(pending):
+                _, tracks = await next_page
+                yield tracks
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def track_query(track):
+    """Builds the youtube search query used to find a Spotify track. """
+    url_info = '{} '.format(track['name'])
+    for artist in track['artists']:
+        url_info += '{} '.format(artist['name'])
+    url_info += 'song music'
+    return url_info
+
+
+def track_key(track):
+    """Returns the key a Spotify track is stored under in the TrackIndex. """
+    if track.get('id'):
+        return track['id']
+    # Tracks without an id (local files, some relinked tracks) fall back to their name and artists
+    names = [track['name']] + [artist['name'] for artist in track['artists']]
+    return ' '.join(' '.join(names).lower().split())
+
+
+class TrackIndex:
+    """Persistent, size bounded map of Spotify tracks to the youtube video that was played for them.
+
+    Least recently used mappings are evicted once there are more than max_entries.
+    """
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self.index = None
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+        if not os.path.isfile(SPOTIFY_INDEX_JSON):
+            create_json(SPOTIFY_INDEX_JSON)
+        self.load_json()
+
+    def load_json(self):
+        self.index = OrderedDict(load_json(SPOTIFY_INDEX_JSON))
+
+    def dump_json(self):
+        dump_json(SPOTIFY_INDEX_JSON, self.index)
+        self.dirty = False
+
+    def get_url(self, key):
+        """Returns the youtube url previously resolved for the track, or None. """
+        try:
+            video_id = self.index[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.index.move_to_end(key)
+        self.hits += 1
+        return YOUTUBE_VIDEO_URL.format(video_id)
+
+    def add(self, key, video_id):
+        if self.index.get(key) == video_id:
+            return
+        self.index[key] = video_id
+        self.index.move_to_end(key)
+        while len(self.index) > self.max_entries:
+            self.index.popitem(last=False)
+        self.dirty = True
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats_string(self):
+        return '{:.0%} hit rate ({} hits, {} misses, {}/{} tracks)'.format(
+            self.hit_rate, self.hits, self.misses, len(self.index), self.max_entries)
@@ -0,0 +1,97 @@
+import os
+import time
+
+
+# Discord expects a 20ms audio frame every 20ms, a read taking longer than that is an underrun
+FRAME_SECONDS = 0.02
+# Fields 14 and 15 of /proc/<pid>/stat are the process' user and system CPU time in clock ticks
+PROC_STAT_UTIME = 13
+PROC_STAT_STIME = 14
+
+
+def get_process_cpu_seconds(pid):
+    """Returns the CPU seconds a process has used, or None where /proc isn't available. """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            # The process name can contain spaces, so split after its closing parenthesis
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    ticks = int(fields[PROC_STAT_UTIME - 2]) + int(fields[PROC_STAT_STIME - 2])
+    return ticks / os.sysconf('SC_CLK_TCK')
+
+
+class StreamTelemetry:
+    """Timings for a single song's audio pipeline, from the play request to the last frame.
+
+    Frame reads happen on the voice client's player thread, so on_read also samples that thread's CPU time
+    between reads, which covers reading, volume scaling and Opus encoding of each frame.
+    """
+    def __init__(self, title):
+        self.title = title
+        self.requested_at = None
+        self.extract_time = None
+        self.spawned_at = time.perf_counter()
+        self.first_frame_at = None
+        self.first_audio_at = None
+        self.frames = 0
+        self.read_time_total = 0.0
+        self.read_time_max = 0.0
+        self.underruns = 0
+        self.thread_cpu_time = 0.0
+        self.ffmpeg_cpu_time = None
+        self.process = None
+        self._last_thread_time = None
+
+    def on_ffmpeg_frame(self):
+        """Called whenever ffmpeg hands us a frame, the first one marks the end of its startup. """
+        if self.first_frame_at is None:
+            self.first_frame_at = time.perf_counter()
+
+    def on_read(self, started, finished, frame):
+        """Called from the player thread every time discord reads a frame. """
+        if not frame:
+            return
+        if self.first_audio_at is None:
+            self.first_audio_at = finished
+
+        read_time = finished - started
+        self.frames += 1
+        self.read_time_total += read_time
+        self.read_time_max = max(self.read_time_max, read_time)
+        if read_time > FRAME_SECONDS:
+            self.underruns += 1
+
+        thread_time = time.thread_time()
+        if self._last_thread_time is not None:
+            self.thread_cpu_time += thread_time - self._last_thread_time
+        self._last_thread_time = thread_time
+
+    def finish(self):
+        """Samples ffmpeg's CPU time, call before the ffmpeg process is killed. """
+        if self.process is not None:
+            cpu_time = get_process_cpu_seconds(self.process.pid)
+            if cpu_time is not None:
+                self.ffmpeg_cpu_time = cpu_time
+
+    def to_dict(self):
+        def since(start, end):
+            if start is None or end is None:
+                return None
+            return round(end - start, 4)
+
+        self.finish()
+        played = self.frames * FRAME_SECONDS
+        return {
+            'title': self.title,
+            'time_to_first_audio': since(self.requested_at, self.first_audio_at),
+            'extract_time': round(self.extract_time, 4) if self.extract_time is not None else None,
+            'ffmpeg_startup_time': since(self.spawned_at, self.first_frame_at),
+            'frames': self.frames,
+            'avg_read_time': round(self.read_time_total / self.frames, 6) if self.frames else None,
+            'max_read_time': round(self.read_time_max, 6),
+            'underruns': self.underruns,
+            'player_cpu_per_second': round(self.thread_cpu_time / played, 4) if played else None,
+            'ffmpeg_cpu_per_second': round(self.ffmpeg_cpu_time / played, 4)
+            if played and self.ffmpeg_cpu_time is not None else None,
+        }
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+
+# Longest a slice of work runs before handing control back to the event loop
+SLICE_BUDGET = 0.005
+
+
+class TimeSlicer:
+    """Iterates over work in slices of at most budget seconds, yielding to the event loop between slices.
+
+    busy is the total time spent running slices, which is the time the loop was kept from everything else.
+    """
+    def __init__(self, budget=SLICE_BUDGET):
+        self.budget = budget
+        self.busy = 0.0
+        self.slices = 0
+
+    async def iterate(self, items):
+        slice_started = time.perf_counter()
+        for item in items:
+            yield item
+            now = time.perf_counter()
+            if now - slice_started >= self.budget:
+                self.busy += now - slice_started
+                self.slices += 1
+                await asyncio.sleep(0)
+                slice_started = time.perf_counter()
+        self.busy += time.perf_counter() - slice_started
+        self.slices += 1
+
+
+class ShardTimings:
+    """Time the event loop spent on one shard's gametime work. """
+    __slots__ = ('reconcile_time', 'reconcile_wall_time', 'reconciled', 'presence_time', 'presence_updates')
+
+    def __init__(self):
+        self.reconcile_time = 0.0
+        self.reconcile_wall_time = 0.0
+        self.reconciled = 0
+        self.presence_time = 0.0
+        self.presence_updates = 0
+
+    def to_string(self, shard_id):
+        presence = (self.presence_time / self.presence_updates * 10 ** 6) if self.presence_updates else 0
+        return 'shard {}: reconciled {} members in {:.0f}ms ({:.1f}s wall), {} presence updates at {:.0f}us'.format(
+            shard_id, self.reconciled, self.reconcile_time * 1000, self.reconcile_wall_time, self.presence_updates,
+            presence)
+
+
+if __name__ == '__main__':
+    # Compare the worst latency a command would see while a big reconcile runs in one burst and time sliced
+    def work():
+        sum(range(200))
+
+    async def measure(sliced, members=200000):
+        latencies = list()
+        done = asyncio.Event()
+
+        async def command_ticker():
+            while not done.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(0.001)
+                latencies.append(time.perf_counter() - started - 0.001)
+
+        ticker = asyncio.ensure_future(command_ticker())
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        if sliced:
+            slicer = TimeSlicer()
+            async for _ in slicer.iterate(range(members)):
+                work()
+        else:
+            for _ in range(members):
+                work()
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.05)
+        done.set()
+        await ticker
+        latencies.sort()
+        print('{:>6}: {:.2f}s total, command latency p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms'.format(
+            'sliced' if sliced else 'burst', elapsed, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000, latencies[-1] * 1000))
+
+    asyncio.run(measure(False))
+    asyncio.run(measure(True))